@@ -0,0 +1,135 @@
+#	gbpig - German Biometric Passport Image Generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of gbpig.
+#
+#	gbpig is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	gbpig is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with gbpig; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+import math
+import numpy
+from Renderer import Renderer
+from PillowRenderer import PillowRenderer
+from StreamWriter import StreamWriter
+import geo
+
+class BandedRenderer(Renderer):
+	"""Records all drawing operations together with the rows they touch and,
+	when writing, replays them band by band into a PillowRenderer. Every
+	finished band is streamed to a PNG or TIFF file, so peak memory is bounded
+	by the band height and the size of the tiles instead of the canvas size.
+	Only operations that overlap a band are replayed for it and source images
+	are only resampled for the rows of the band.
+
+	The output is identical to rendering the whole canvas at once. Pillow
+	truncates coordinates towards zero, so shifting a primitive that starts
+	above a band would move it by one row. Primitives that Pillow rasterizes
+	at integer coordinates anyway (lines and rectangles) are therefore
+	truncated before they are shifted. Text and circles are rasterized with
+	their fractional part, so every band is rendered from an origin at or
+	above all of those it replays and cropped afterwards."""
+	def __init__(self, band_height = 512, resolution = None, verbose = 0, source_cache = None):
+		super().__init__(verbose = verbose)
+		self._band_height = band_height
+		self._resolution = resolution
+		self._band_renderer = PillowRenderer(verbose = verbose, source_cache = source_cache)
+		self._dimensions = None
+		self._background = None
+		self._tile_heights = { }
+		self._operations = [ ]
+		self._band = None
+
+	def _record(self, y_min, y_max, replay, integral = True):
+		# Non-integral operations need the band origin to be above them
+		self._operations.append((y_min, y_max, replay, integral))
+
+	@staticmethod
+	def _shift(point, origin):
+		return geo.Vector2d(point[0], point[1] - origin)
+
+	@staticmethod
+	def _snap(point, origin):
+		return geo.Vector2d(point[0], int(point[1]) - origin)
+
+	def new_canvas(self, dimensions, background):
+		self._dimensions = (round(dimensions.x), round(dimensions.y))
+		self._background = background
+		self._operations = [ ]
+
+	def render_tile(self, name, infile, affine, dimensions, region = None):
+		# Tiles are small compared to the canvas, render them right away
+		self._band_renderer.render_tile(name, infile, affine, dimensions, region = region)
+		self._tile_heights[name] = round(dimensions.y)
+
+	def place_tile(self, name, pos):
+		self._record(round(pos.y), round(pos.y) + self._tile_heights[name], lambda renderer, origin: renderer.place_tile(name, self._shift(pos, origin)))
+
+	def blit(self, infile, affine, cropbox, region = None):
+		y_min = round(cropbox.base.y)
+		y_max = y_min + round(cropbox.dimensions.y)
+		def replay(renderer, origin):
+			# Only resample the rows of the cropbox that lie within the band
+			(band_top, band_bottom) = self._band
+			band_y_min = max(y_min, band_top)
+			band_y_max = min(y_max, band_bottom)
+			band_cropbox = geo.Box2d(base = geo.Vector2d(cropbox.base.x, band_y_min), dimensions = geo.Vector2d(cropbox.dimensions.x, band_y_max - band_y_min))
+			renderer.blit(infile, affine, band_cropbox, region = region, y_offset = origin)
+		self._record(y_min, y_max, replay)
+
+	def draw_line(self, p1, p2, stroke, stroke_width = 1):
+		self._record(min(p1[1], p2[1]) - stroke_width, max(p1[1], p2[1]) + stroke_width, lambda renderer, origin: renderer.draw_line(self._snap(p1, origin), self._snap(p2, origin), stroke = stroke, stroke_width = stroke_width))
+
+	def draw_lines(self, segments, stroke, stroke_width = 1):
+		# Keep the batch, but only replay the segments that touch the band
+		y_min = min(min(y1, y2) for (x1, y1, x2, y2) in segments) - stroke_width
+		y_max = max(max(y1, y2) for (x1, y1, x2, y2) in segments) + stroke_width
+		def replay(renderer, origin):
+			(band_top, band_bottom) = self._band
+			band_segments = [ (x1, int(y1) - origin, x2, int(y2) - origin) for (x1, y1, x2, y2) in segments if (max(y1, y2) + stroke_width > band_top) and (min(y1, y2) - stroke_width < band_bottom) ]
+			renderer.draw_lines(band_segments, stroke = stroke, stroke_width = stroke_width)
+		if len(segments) > 0:
+			self._record(y_min, y_max, replay)
+
+	def draw_rectangle(self, box, stroke, stroke_width = 1, fill = None):
+		def shifted_box(origin):
+			base = self._snap(box.base, origin)
+			upper = self._snap(box.base + box.dimensions, origin)
+			return geo.Box2d(base = base, dimensions = geo.Vector2d(box.dimensions.x, upper.y - base.y))
+		self._record(box.base.y - stroke_width, box.base.y + box.dimensions.y + stroke_width, lambda renderer, origin: renderer.draw_rectangle(shifted_box(origin), stroke = stroke, stroke_width = stroke_width, fill = fill))
+
+	def draw_circle(self, center, radius, stroke, fill, stroke_width = 1):
+		self._record(center[1] - radius - stroke_width, center[1] + radius + stroke_width, lambda renderer, origin: renderer.draw_circle(self._shift(center, origin), radius, stroke = stroke, fill = fill, stroke_width = stroke_width), integral = False)
+
+	def draw_text(self, pos, text, color = "red", font_size = 12):
+		# Text is anchored at its baseline, allow for ascenders and descenders
+		self._record(pos.y - (2 * font_size), pos.y + font_size, lambda renderer, origin: renderer.draw_text(self._shift(pos, origin), text, color = color, font_size = font_size), integral = False)
+
+	def write(self, filename):
+		(width, height) = self._dimensions
+		with StreamWriter.open(filename, width, height, resolution = self._resolution) as writer:
+			for top in range(0, height, self._band_height):
+				band_height = min(self._band_height, height - top)
+				self._band = (top, top + band_height)
+				band_operations = [ (replay, y_min, integral) for (y_min, y_max, replay, integral) in self._operations if (y_max > top) and (y_min < top + band_height) ]
+				origin = min([ top ] + [ math.floor(y_min) for (replay, y_min, integral) in band_operations if not integral ])
+				self._band_renderer.new_canvas(geo.Vector2d(width, top + band_height - origin), self._background)
+				for (replay, y_min, integral) in band_operations:
+					replay(self._band_renderer, origin)
+				if self._verbose >= 3:
+					print("Band %d - %d: %d of %d operations, origin %d" % (top, top + band_height, len(band_operations), len(self._operations), origin))
+				writer.write_band(numpy.asarray(self._band_renderer.finish())[top - origin : ])
+		self._operations = [ ]
@@ -0,0 +1,321 @@
+#	gbpig - German Biometric Passport Image Generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of gbpig.
+#
+#	gbpig is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	gbpig is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with gbpig; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+import math
+from Tools import ImageTools
+
+class Classifier():
+	POIS = [ "left_eye", "right_eye", "nose", "head_y", "chin_y" ]
+
+	@classmethod
+	def create_json_data(cls, image_filename, pois, confidence = None):
+		json_data = {
+			"image": {
+				"filename":		image_filename,
+				"geometry":		ImageTools.get_image_geometry(image_filename),
+			},
+			"pois": pois,
+		}
+		if confidence is not None:
+			json_data["confidence"] = confidence
+		return json_data
+
+class ManualClassifier(Classifier):
+	_PROMPTS = {
+		"left_eye":		"Left eye coordinates (x, y) ",
+		"right_eye":	"Right eye coordinates (x, y)",
+		"nose":			"Nose coordinates (x, y)     ",
+		"head_y":		"Head Y value                ",
+		"chin_y":		"Chin Y value                ",
+	}
+
+	@classmethod
+	def _get_coordinates(cls, prompt, default = None):
+		while True:
+			value = input(prompt)
+			if (value.strip() == "") and (default is not None):
+				return default
+			value = value.split(",")
+			return (int(value[0]), int(value[1]))
+
+	@classmethod
+	def _get_value(cls, prompt, default = None):
+		while True:
+			value = input(prompt)
+			if (value.strip() == "") and (default is not None):
+				return default
+			value = int(value)
+			return value
+
+	def classify(self, pois = None, only = None):
+		"""Prompts for all POIs, or only for the given ones. Values in pois are
+		offered as defaults that are accepted by pressing enter."""
+		pois = dict(pois or { })
+		for name in self.POIS:
+			if (only is not None) and (name not in only):
+				continue
+			default = pois.get(name)
+			if default is None:
+				prompt = self._PROMPTS[name] + ": "
+			elif isinstance(default, (list, tuple)):
+				prompt = self._PROMPTS[name] + " [%d, %d]: " % tuple(default)
+			else:
+				prompt = self._PROMPTS[name] + " [%d]: " % (default)
+			if name.endswith("_y"):
+				pois[name] = self._get_value(prompt, default)
+			else:
+				pois[name] = self._get_coordinates(prompt, default)
+		return pois
+
+class AutoClassifier(Classifier):
+	"""Estimates the POIs using classical, CPU-only detectors from OpenCV: Haar
+	cascades for face and eyes, optionally an LBF facial landmark model, and
+	gradient profiles along the face's vertical axis for the top of the head
+	and the chin. Every POI is accompanied by a confidence between 0 and 1."""
+
+	# Typical proportions relative to the interocular distance
+	_EYES_TO_NOSE = 0.6
+	_EYES_TO_CHIN = 1.8
+	_EYES_TO_HEAD = 1.75
+	_DETECTION_SIZE = 1000
+
+	def __init__(self, cascade_dir = None, landmark_model = None):
+		import cv2
+		self._cv2 = cv2
+		cascade_dir = cascade_dir or cv2.data.haarcascades
+		self._face_cascade = self._load_cascade(cascade_dir, "haarcascade_frontalface_default.xml")
+		self._eye_cascade = self._load_cascade(cascade_dir, "haarcascade_eye.xml")
+		if landmark_model is not None:
+			if not hasattr(cv2, "face"):
+				raise Exception("Landmark models require the OpenCV contrib modules (cv2.face).")
+			self._facemark = cv2.face.createFacemarkLBF()
+			self._facemark.loadModel(landmark_model)
+		else:
+			self._facemark = None
+
+	def _load_cascade(self, cascade_dir, filename):
+		cascade = self._cv2.CascadeClassifier(cascade_dir.rstrip("/") + "/" + filename)
+		if cascade.empty():
+			raise Exception("Unable to load Haar cascade %s from %s" % (filename, cascade_dir))
+		return cascade
+
+	def _load_image(self, filename):
+		# POIs refer to the stored pixel orientation, so EXIF orientation must
+		# not be applied. Large images are decoded at reduced size directly.
+		cv2 = self._cv2
+		(width, height) = ImageTools.get_image_geometry(filename)
+		for (reduction, flag) in ((8, cv2.IMREAD_REDUCED_GRAYSCALE_8), (4, cv2.IMREAD_REDUCED_GRAYSCALE_4), (2, cv2.IMREAD_REDUCED_GRAYSCALE_2), (1, cv2.IMREAD_GRAYSCALE)):
+			if max(width, height) / reduction >= self._DETECTION_SIZE:
+				break
+		image = cv2.imread(filename, flag | cv2.IMREAD_IGNORE_ORIENTATION)
+		if image is None:
+			raise Exception("Unable to read image: %s" % (filename))
+		return (image, width / image.shape[1])
+
+	@staticmethod
+	def _rotate_point(point, center, angle):
+		(s, c) = (math.sin(angle), math.cos(angle))
+		(dx, dy) = (point[0] - center[0], point[1] - center[1])
+		return (center[0] + (c * dx) - (s * dy), center[1] + (s * dx) + (c * dy))
+
+	def _rotate_image(self, gray, angle_deg):
+		"""Rotates the image around its center by the given angle (counter
+		clockwise, as cv2.getRotationMatrix2D does). Returns the rotated image
+		along with the angle (in radians) that _rotate_point() needs to map
+		points of the rotated image back onto the original image."""
+		if angle_deg == 0:
+			return (gray, 0)
+		cv2 = self._cv2
+		center = (gray.shape[1] / 2, gray.shape[0] / 2)
+		matrix = cv2.getRotationMatrix2D(center, angle_deg, 1)
+		rotated = cv2.warpAffine(gray, matrix, (gray.shape[1], gray.shape[0]), borderMode = cv2.BORDER_REPLICATE)
+		return (rotated, angle_deg / 180 * math.pi)
+
+	def _detect_face(self, gray):
+		"""Returns the largest face as (x, y, w, h) in the image it was found
+		in, that image (possibly rotated) and the angle that maps points of it
+		back onto the original image."""
+		min_size = min(gray.shape) // 8
+		for angle_deg in [ 0, -15, 15, -30, 30 ]:
+			(rotated, back_angle) = self._rotate_image(gray, angle_deg)
+			faces = self._face_cascade.detectMultiScale(rotated, scaleFactor = 1.1, minNeighbors = 5, minSize = (min_size, min_size))
+			if len(faces) > 0:
+				face = max(faces, key = lambda face: face[2] * face[3])
+				return (tuple(int(value) for value in face), rotated, back_angle)
+		return (None, None, None)
+
+	def _detect_eyes(self, gray, face):
+		(x, y, w, h) = face
+		roi = gray[y : y + int(h * 0.6), x : x + w]
+		(eyes, reject_levels, level_weights) = self._eye_cascade.detectMultiScale3(roi, scaleFactor = 1.05, minNeighbors = 3, minSize = (w // 10, w // 10), maxSize = (w // 3, w // 3), outputRejectLevels = True)
+		candidates = [ ((ex + x + (ew / 2), ey + y + (eh / 2)), float(weight)) for ((ex, ey, ew, eh), weight) in zip(eyes, level_weights) ]
+
+		# Pick the best pair of eyes that is plausible for this face
+		best = None
+		for i in range(len(candidates)):
+			for j in range(i + 1, len(candidates)):
+				((p1, w1), (p2, w2)) = (candidates[i], candidates[j])
+				(left, right) = (p1, p2) if (p1[0] < p2[0]) else (p2, p1)
+				distance = math.hypot(right[0] - left[0], right[1] - left[1])
+				angle = math.atan2(right[1] - left[1], right[0] - left[0])
+				if (0.25 * w <= distance <= 0.6 * w) and (abs(angle) < 0.35):
+					score = min(w1, w2)
+					if (best is None) or (score > best[2]):
+						best = (left, right, score)
+		if best is None:
+			# Assume typical eye positions within the face box
+			return ((x + 0.3 * w, y + 0.4 * h), (x + 0.7 * w, y + 0.4 * h), 0.2, 0.2)
+		confidence = min(1, 0.5 + best[2] / 6)
+		return (best[0], best[1], confidence, confidence)
+
+	def _detect_landmarks(self, gray, face):
+		import numpy
+		(success, landmarks) = self._facemark.fit(gray, numpy.array([ face ]))
+		if not success:
+			return None
+		points = landmarks[0][0]
+		return {
+			"left_eye":		tuple(points[36 : 42].mean(axis = 0)),
+			"right_eye":	tuple(points[42 : 48].mean(axis = 0)),
+			"nose":			tuple(points[30]),
+			"chin":			tuple(points[8]),
+		}
+
+	@staticmethod
+	def _agreement(value, prior, tolerance):
+		return math.exp(-0.5 * ((value - prior) / tolerance) ** 2)
+
+	@staticmethod
+	def _step_profile(intensities, window):
+		"""Returns for every row the absolute difference between the mean
+		intensity of the window rows above and below it. Unlike a plain
+		gradient, this ignores fine texture such as foliage in the background
+		and responds to the transition between larger areas like hair and
+		background or chin and neck."""
+		import numpy
+		cumulative = numpy.concatenate([ [ 0 ], numpy.cumsum(intensities) ])
+		profile = numpy.zeros_like(intensities)
+		if len(intensities) > 2 * window:
+			rows = numpy.arange(window, len(intensities) - window)
+			above = (cumulative[rows] - cumulative[rows - window]) / window
+			below = (cumulative[rows + window] - cumulative[rows]) / window
+			profile[window : len(intensities) - window] = numpy.abs(below - above)
+		return profile
+
+	def _profile_peak(self, profile, eye_y, start, end, prior, tolerance):
+		"""Finds the strongest transition in the given range of the profile
+		(offsets relative to eye_y) and rates it by its prominence and its
+		agreement with the prior."""
+		(lo, hi) = (max(0, int(eye_y + min(start, end))), min(len(profile), int(eye_y + max(start, end))))
+		if hi - lo < 3:
+			return (eye_y + prior, 0.1)
+		section = profile[lo : hi]
+		peak = lo + int(section.argmax())
+		median = float(sorted(section)[len(section) // 2]) or 1
+		prominence = min(1, (float(profile[peak]) / median - 1) / 3)
+		agreement = self._agreement(peak - eye_y, prior, tolerance)
+		return (peak, max(0.05, prominence * agreement))
+
+	def _classify_gray(self, gray):
+		import numpy
+		cv2 = self._cv2
+		(face, rotated, face_angle) = self._detect_face(gray)
+		if face is None:
+			return None
+
+		landmarks = self._detect_landmarks(rotated, face) if (self._facemark is not None) else None
+		if landmarks is not None:
+			(left_eye, right_eye) = (landmarks["left_eye"], landmarks["right_eye"])
+			(left_confidence, right_confidence) = (0.9, 0.9)
+		else:
+			(left_eye, right_eye, left_confidence, right_confidence) = self._detect_eyes(rotated, face)
+
+		# Bring the eyes back into unrotated image coordinates
+		image_center = (gray.shape[1] / 2, gray.shape[0] / 2)
+		(left_eye, right_eye) = (self._rotate_point(left_eye, image_center, face_angle), self._rotate_point(right_eye, image_center, face_angle))
+		eye_center = ((left_eye[0] + right_eye[0]) / 2, (left_eye[1] + right_eye[1]) / 2)
+		eye_distance = math.hypot(right_eye[0] - left_eye[0], right_eye[1] - left_eye[1])
+		eye_angle = math.atan2(right_eye[1] - left_eye[1], right_eye[0] - left_eye[0])
+
+		# Level the eyes so that the face's vertical axis becomes a column
+		matrix = cv2.getRotationMatrix2D(eye_center, eye_angle / math.pi * 180, 1)
+		leveled = cv2.warpAffine(gray, matrix, (gray.shape[1], gray.shape[0]), borderMode = cv2.BORDER_REPLICATE)
+		band = (max(0, int(eye_center[0] - eye_distance / 4)), min(gray.shape[1], int(eye_center[0] + eye_distance / 4)))
+		intensities = leveled[:, band[0] : band[1]].astype(numpy.float32).mean(axis = 1)
+		profile = self._step_profile(intensities, max(1, int(0.12 * eye_distance)))
+		tolerance = 0.15 * eye_distance
+
+		(head_y, head_confidence) = self._profile_peak(profile, eye_center[1], -1.2 * eye_distance, -2.3 * eye_distance, -self._EYES_TO_HEAD * eye_distance, tolerance)
+		if landmarks is not None:
+			chin = self._rotate_point(landmarks["chin"], image_center, face_angle)
+			(chin_y, chin_confidence) = (self._rotate_point(chin, eye_center, -eye_angle)[1], 0.9)
+			nose = self._rotate_point(landmarks["nose"], image_center, face_angle)
+			nose_confidence = 0.9
+		else:
+			(chin_y, chin_confidence) = self._profile_peak(profile, eye_center[1], 1.4 * eye_distance, 2.2 * eye_distance, self._EYES_TO_CHIN * eye_distance, tolerance)
+
+			# The nostrils are the darkest feature right below the nose tip
+			(lo, hi) = (int(eye_center[1] + 0.45 * eye_distance), int(eye_center[1] + 0.85 * eye_distance))
+			narrow_band = leveled[lo : hi, max(0, int(eye_center[0] - eye_distance / 6)) : int(eye_center[0] + eye_distance / 6)]
+			if narrow_band.size > 0:
+				nostril_y = lo + int(narrow_band.mean(axis = 1).argmin())
+				nose_y = nostril_y - 0.08 * eye_distance
+				nose_confidence = 0.7 * self._agreement(nose_y - eye_center[1], self._EYES_TO_NOSE * eye_distance, 0.1 * eye_distance)
+			else:
+				(nose_y, nose_confidence) = (eye_center[1] + self._EYES_TO_NOSE * eye_distance, 0.1)
+			nose = self._rotate_point((eye_center[0], nose_y), eye_center, eye_angle)
+
+		# The top of head and chin lie on the face's vertical axis; only their
+		# Y coordinates are recorded.
+		head = self._rotate_point((eye_center[0], head_y), eye_center, eye_angle)
+		chin = self._rotate_point((eye_center[0], chin_y), eye_center, eye_angle)
+
+		# Nose, head and chin are searched relative to the eyes, so they can
+		# never be more trustworthy than the eyes are
+		eye_confidence = min(left_confidence, right_confidence)
+		(nose_confidence, head_confidence, chin_confidence) = (min(nose_confidence, eye_confidence), min(head_confidence, eye_confidence), min(chin_confidence, eye_confidence))
+		return {
+			"left_eye":		(left_eye, left_confidence),
+			"right_eye":	(right_eye, right_confidence),
+			"nose":			(nose, nose_confidence),
+			"head_y":		(head[1], head_confidence),
+			"chin_y":		(chin[1], chin_confidence),
+		}
+
+	def classify(self, image_filename):
+		"""Returns a tuple of POIs and per-POI confidences for the image, or
+		None if no face was found."""
+		(gray, scale) = self._load_image(image_filename)
+		gray = self._cv2.equalizeHist(gray)
+		result = self._classify_gray(gray)
+		if result is None:
+			return None
+
+		pois = { }
+		confidence = { }
+		for (name, (value, value_confidence)) in result.items():
+			if isinstance(value, tuple):
+				pois[name] = [ round(value[0] * scale), round(value[1] * scale) ]
+			else:
+				pois[name] = round(value * scale)
+			confidence[name] = round(value_confidence, 3)
+		return (pois, confidence)
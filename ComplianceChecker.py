@@ -0,0 +1,146 @@
+#	gbpig - German Biometric Passport Image Generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of gbpig.
+#
+#	gbpig is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	gbpig is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with gbpig; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+import numpy
+from PassportGenerator import PassportGenerator
+from Tools import ImageTools
+
+class ComplianceChecker():
+	"""Evaluates many classified JSON files at once against the constraints of
+	a picture type. It computes the same geometry that PassportGenerator uses
+	for rendering, but as array operations over all files and without
+	touching any image pixels."""
+	_IMAGE_DIMENSION_MM = (35, 45)
+
+	def __init__(self, picture_type = "adult", resolution = 300):
+		self._definitions = PassportGenerator._DEFINITIONS[picture_type]
+		self._resolution = resolution
+
+	@staticmethod
+	def _dot(a, b):
+		return (a * b).sum(axis = 1)
+
+	@classmethod
+	def extract(cls, json_data):
+		"""Returns the values of a single classified JSON file that the check
+		needs. Raises ValueError if POIs or image information are missing or
+		malformed and OSError if the image geometry cannot be determined."""
+		try:
+			pois = json_data["pois"]
+			points = [ (float(pois[name][0]), float(pois[name][1])) for name in [ "left_eye", "right_eye", "nose" ] ]
+			values = [ float(pois[name]) for name in [ "head_y", "chin_y" ] ]
+			image = json_data["image"]
+			geometry = image["geometry"] if ("geometry" in image) else ImageTools.get_image_geometry(image["filename"])
+			geometry = (float(geometry[0]), float(geometry[1]))
+		except KeyError as e:
+			raise ValueError("missing %s" % (str(e)))
+		except (IndexError, TypeError):
+			raise ValueError("malformed POIs or image geometry")
+		return tuple(points + values + [ geometry ])
+
+	def check(self, json_datas):
+		"""Returns a dictionary of arrays, one entry per input."""
+		return self.check_extracted([ self.extract(json_data) for json_data in json_datas ])
+
+	def check_extracted(self, records):
+		"""Like check(), but for the results of extract(), so that callers can
+		sort out bad files individually beforehand."""
+		(left_eye, right_eye, nose, head_y, chin_y, geometry) = (numpy.array(column, dtype = float) for column in zip(*records))
+		definitions = self._definitions
+
+		with numpy.errstate(divide = "ignore", invalid = "ignore"):
+			# Top of head and chin lie on the axis perpendicular to the eyes
+			eye_center = (left_eye + right_eye) / 2
+			eye_vector = right_eye - left_eye
+			up_vector = numpy.stack([ eye_vector[:, 1], -eye_vector[:, 0] ], axis = 1)
+			top = eye_center + ((head_y - eye_center[:, 1]) / up_vector[:, 1])[:, numpy.newaxis] * up_vector
+			chin = eye_center + ((chin_y - eye_center[:, 1]) / up_vector[:, 1])[:, numpy.newaxis] * up_vector
+			eye_angle_deg = numpy.degrees(numpy.arctan2(eye_vector[:, 1], eye_vector[:, 0]))
+
+			# Scale factor, clamped like PassportGenerator._compute_scale_factor
+			px_per_mm = self._resolution / 25.4
+			chin_to_head_orig_px = numpy.linalg.norm(top - chin, axis = 1)
+			scale_min = definitions["chin-to-head"][0] * px_per_mm / chin_to_head_orig_px
+			scale_max = definitions["chin-to-head"][1] * px_per_mm / chin_to_head_orig_px
+			scale_ideal = (definitions["chin-to-head-ideal"][0] + definitions["chin-to-head-ideal"][1]) / 2 * px_per_mm / chin_to_head_orig_px
+			scale = numpy.clip(scale_ideal, scale_min, scale_max)
+			mm_per_source_px = scale / px_per_mm
+			head_to_chin_mm = chin_to_head_orig_px * mm_per_source_px
+
+			# Output frame: unit vectors along the eyes (u) and towards the
+			# chin (v), in source coordinates. The nose ends up centered
+			# horizontally and the eyes at the middle of the top-to-eyes range.
+			u = eye_vector / numpy.linalg.norm(eye_vector, axis = 1)[:, numpy.newaxis]
+			v = numpy.stack([ -u[:, 1], u[:, 0] ], axis = 1)
+			v *= numpy.sign(self._dot(chin - eye_center, v))[:, numpy.newaxis]
+			top_to_eyes_mm = (definitions["top-to-eyes"][0] + definitions["top-to-eyes"][1]) / 2
+			top_margin_mm = top_to_eyes_mm + self._dot(top - left_eye, v) * mm_per_source_px
+			chin_margin_mm = self._IMAGE_DIMENSION_MM[1] - (top_to_eyes_mm + self._dot(chin - left_eye, v) * mm_per_source_px)
+
+			# Every corner of the inner image must map into the source image
+			covered = numpy.ones(len(records), dtype = bool)
+			nose_u = self._dot(nose, u)
+			left_eye_v = self._dot(left_eye, v)
+			for corner_x in (0, self._IMAGE_DIMENSION_MM[0]):
+				for corner_y in (0, self._IMAGE_DIMENSION_MM[1]):
+					along_u = nose_u + (corner_x - self._IMAGE_DIMENSION_MM[0] / 2) / mm_per_source_px
+					along_v = left_eye_v + (corner_y - top_to_eyes_mm) / mm_per_source_px
+					source = (along_u[:, numpy.newaxis] * u) + (along_v[:, numpy.newaxis] * v)
+					covered &= (source >= 0).all(axis = 1) & (source <= geometry).all(axis = 1)
+
+		valid = numpy.isfinite(scale) & numpy.isfinite(top_margin_mm) & numpy.isfinite(chin_margin_mm)
+		within_limits = (definitions["chin-to-head"][0] <= head_to_chin_mm) & (head_to_chin_mm <= definitions["chin-to-head"][1])
+		within_ideal = (definitions["chin-to-head-ideal"][0] <= head_to_chin_mm) & (head_to_chin_mm <= definitions["chin-to-head-ideal"][1])
+		illegal = (~valid) | (~within_limits) | (top_margin_mm < 0) | (chin_margin_mm < 0) | (~covered)
+		borderline = (~within_ideal) | (scale > 1)
+		status = numpy.where(illegal, "illegal", numpy.where(borderline, "borderline", "OK"))
+
+		return {
+			"status":				status,
+			"eye_angle_deg":		eye_angle_deg,
+			"scale":				scale,
+			"head_to_chin_mm":		head_to_chin_mm,
+			"top_margin_mm":		top_margin_mm,
+			"chin_margin_mm":		chin_margin_mm,
+			"covered":				covered,
+			"valid":				valid,
+			"within_ideal":			within_ideal,
+			"upscaled":				scale > 1,
+		}
+
+	@classmethod
+	def reasons(cls, result, index):
+		reasons = [ ]
+		if not result["valid"][index]:
+			reasons.append("invalid POIs")
+		else:
+			if result["top_margin_mm"][index] < 0:
+				reasons.append("top of head cut off")
+			if result["chin_margin_mm"][index] < 0:
+				reasons.append("chin cut off")
+			if not result["covered"][index]:
+				reasons.append("photo does not cover image")
+			if not result["within_ideal"][index]:
+				reasons.append("head-to-chin outside ideal range")
+			if result["upscaled"][index]:
+				reasons.append("source resolution too low")
+		return reasons
@@ -0,0 +1,192 @@
+#	gbpig - German Biometric Passport Image Generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of gbpig.
+#
+#	gbpig is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	gbpig is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with gbpig; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+import os
+import json
+import math
+import collections
+from PassportGenerator import PassportGenerator
+import geo
+
+ImpositionJob = collections.namedtuple("ImpositionJob", [ "json_filename", "copies", "overrides" ])
+
+class SheetImposer():
+	"""Lays out the portraits of many jobs, each with a number of copies, on as
+	few sheets of paper as possible. All bordered portraits have the same
+	size, so they are arranged in a grid whose tiles touch each other. Cut
+	marks are only drawn around the outside of the grid: every cut runs
+	across the whole sheet, so adjacent tiles share their cuts. Every portrait
+	is transformed only once, no matter on how many sheets it appears."""
+	_PAPER_SIZES = {
+		"A5":		(148, 210),
+		"A4":		(210, 297),
+		"A3":		(297, 420),
+		"letter":	(215.9, 279.4),
+		"10x15":	(100, 150),
+	}
+	_MULTIPAGE_FORMATS = [ ".pdf", ".tif", ".tiff" ]
+	_SHEET_OPTIONS = [ "resolution", "border_size", "line_size", "backend", "profile" ]
+
+	def __init__(self, args, source_cache = None):
+		self._args = args
+		self._source_cache = source_cache
+		self._jobs = [ ]
+
+	@classmethod
+	def paper_sizes(cls):
+		return list(cls._PAPER_SIZES)
+
+	@property
+	def jobs(self):
+		return iter(self._jobs)
+
+	def add_job(self, json_filename, copies = 1, **overrides):
+		if isinstance(copies, bool) or (not isinstance(copies, int)):
+			raise ValueError("Job %s needs an integer number of copies, %s given." % (json_filename, json.dumps(copies)))
+		if copies < 1:
+			raise ValueError("Job %s needs at least one copy, %d given." % (json_filename, copies))
+
+		# Only render options may be overridden, with values of the right type
+		for key in overrides:
+			if key.replace("-", "_") in self._SHEET_OPTIONS:
+				raise ValueError("Job %s overrides '%s', which needs to be the same for all jobs on a sheet." % (json_filename, key))
+		try:
+			overrides = PassportGenerator.coerce_options(overrides)
+		except ValueError as e:
+			raise ValueError("Job %s: %s" % (json_filename, str(e)))
+		self._jobs.append(ImpositionJob(json_filename = json_filename, copies = copies, overrides = overrides))
+
+	def _to_px(self, mm):
+		return mm / 25.4 * self._args.resolution
+
+	def _grid_size(self, paper_mm, tile_mm):
+		usable = paper_mm - (2 * geo.Vector2d(self._args.margin + self._args.line_size, self._args.margin + self._args.line_size))
+		return (max(0, math.floor(usable.x / tile_mm.x)), max(0, math.floor(usable.y / tile_mm.y)))
+
+	def compute_layout(self):
+		"""Returns the paper dimensions in mm and the number of tiles per row
+		and column, picking the paper orientation that holds more tiles."""
+		tile_mm = geo.Vector2d(35, 45) + (2 * geo.Vector2d(self._args.border_size, self._args.border_size))
+		(width, height) = self._PAPER_SIZES[self._args.paper]
+		candidates = [ ]
+		if self._args.orientation in [ "auto", "portrait" ]:
+			candidates.append(geo.Vector2d(min(width, height), max(width, height)))
+		if self._args.orientation in [ "auto", "landscape" ]:
+			candidates.append(geo.Vector2d(max(width, height), min(width, height)))
+		(paper_mm, (columns, rows)) = max(((paper_mm, self._grid_size(paper_mm, tile_mm)) for paper_mm in candidates), key = lambda candidate: candidate[1][0] * candidate[1][1])
+		if columns * rows == 0:
+			raise ValueError("A portrait of %.0f x %.0f mm with cut marks does not fit on %s paper with %.0f mm margin." % (tile_mm.x, tile_mm.y, self._args.paper, self._args.margin))
+		return (paper_mm, columns, rows)
+
+	def _job_args(self, job):
+		job_args = PassportGenerator.create_args(resolution = self._args.resolution, border_size = self._args.border_size, line_size = self._args.line_size, picture_type = self._args.picture_type, backend = self._args.backend, full_decode = self._args.full_decode)
+		job_args.verbose = self._args.verbose
+		job_args.json_input_filename = job.json_filename
+		for (key, value) in job.overrides.items():
+			setattr(job_args, key, value)
+		return job_args
+
+	def _page_filename(self, output_filename, page_count):
+		(stem, ext) = os.path.splitext(output_filename)
+		if (ext.lower() in self._MULTIPAGE_FORMATS) or ("%" in output_filename) or (page_count == 1):
+			return output_filename
+		return "%s_%%0%dd%s" % (stem, max(2, len(str(page_count))), ext)
+
+	def _place_cutmarks(self, origin_px, tile_px, columns, rows):
+		border_px = self._to_px(self._args.border_size)
+		line_px = self._to_px(self._args.line_size)
+		(x_min, y_min) = (origin_px.x, origin_px.y)
+		(x_max, y_max) = (origin_px.x + (columns * tile_px.x), origin_px.y + (rows * tile_px.y))
+
+		# Bordered and inner image edges of every column and row, drawn
+		# outside the grid only
+		x_cuts = [ x for column in range(columns) for x in [ x_min + (column * tile_px.x) + offset for offset in (0, border_px, tile_px.x - border_px) ] ] + [ x_max ]
+		y_cuts = [ y for row in range(rows) for y in [ y_min + (row * tile_px.y) + offset for offset in (0, border_px, tile_px.y - border_px) ] ] + [ y_max ]
+		segments = [ ]
+		for x in x_cuts:
+			segments += [ (x, y_min, x, y_min - line_px), (x, y_max, x, y_max + line_px) ]
+		for y in y_cuts:
+			segments += [ (x_min, y, x_min - line_px, y), (x_max, y, x_max + line_px, y) ]
+		self._renderer.draw_lines(segments, stroke = "#000000")
+
+	def run(self, output_filename):
+		"""Renders all jobs and returns the list of (page, slot, job) triples
+		that describes which portrait ended up where."""
+		if len(self._jobs) == 0:
+			raise ValueError("No jobs to impose.")
+		(paper_mm, columns, rows) = self.compute_layout()
+		slots_per_page = columns * rows
+		copy_count = sum(job.copies for job in self._jobs)
+		page_count = (copy_count + slots_per_page - 1) // slots_per_page
+		if self._args.verbose >= 1:
+			print("Imposing %d portraits of %d jobs on %d %s sheet(s) of %.0f x %.0f mm, %d x %d per sheet." % (copy_count, len(self._jobs), page_count, self._args.paper, paper_mm.x, paper_mm.y, columns, rows))
+
+		self._renderer = PassportGenerator.create_renderer(self._args.backend, verbose = self._args.verbose, source_cache = self._source_cache)
+		self._renderer.new_document()
+
+		# Transform every portrait exactly once; copies only composite the tile
+		tile_px = None
+		for (job_no, job) in enumerate(self._jobs):
+			ppgen = PassportGenerator(self._job_args(job), source_cache = self._source_cache)
+			tile_px = ppgen.render_tile(self._renderer, "job%d" % (job_no))
+
+		paper_px = geo.Vector2d(round(self._to_px(paper_mm.x)), round(self._to_px(paper_mm.y)))
+		grid_px = geo.Vector2d(columns * tile_px.x, rows * tile_px.y)
+		origin_px = geo.Vector2d(round((paper_px.x - grid_px.x) / 2), round((paper_px.y - grid_px.y) / 2))
+
+		placements = [ ]
+		slots = [ (job_no, job) for (job_no, job) in enumerate(self._jobs) for copy in range(job.copies) ]
+		for page_no in range(page_count):
+			page_slots = slots[page_no * slots_per_page : (page_no + 1) * slots_per_page]
+			self._renderer.new_page(paper_px, "white")
+			for (slot_no, (job_no, job)) in enumerate(page_slots):
+				(row, column) = divmod(slot_no, columns)
+				self._renderer.place_tile("job%d" % (job_no), origin_px + geo.Vector2d(column * tile_px.x, row * tile_px.y))
+				placements.append((page_no + 1, slot_no, job))
+			# Only the rows that are actually used need cut marks
+			used_rows = (len(page_slots) + columns - 1) // columns
+			self._place_cutmarks(origin_px, tile_px, columns, used_rows)
+		self._renderer.write_document(self._page_filename(output_filename, page_count), resolution = self._args.resolution)
+		return placements
+
+	def add_manifest(self, filename, default_copies = 1):
+		"""Adds the jobs of a JSONL manifest with one job per line. Every job
+		needs an 'input' key and may have a 'copies' key; all other keys
+		override the render options for that job (e.g., 'picture_type').
+		Returns a list of errors as "filename:line: message" strings, one for
+		every line that could not be added."""
+		errors = [ ]
+		with open(filename) as f:
+			for (lineno, line) in enumerate(f, 1):
+				line = line.strip()
+				if (line == "") or line.startswith("#"):
+					continue
+				try:
+					job = json.loads(line)
+					if (not isinstance(job, dict)) or (not isinstance(job.get("input"), str)):
+						raise ValueError("Job needs an 'input' filename.")
+					json_filename = job.pop("input")
+					copies = job.pop("copies", default_copies)
+					self.add_job(json_filename, copies = copies, **job)
+				except ValueError as e:
+					errors.append("%s:%d: %s" % (filename, lineno, str(e)))
+		return errors
@@ -0,0 +1,114 @@
+#	gbpig - German Biometric Passport Image Generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of gbpig.
+#
+#	gbpig is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	gbpig is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with gbpig; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+import os
+import json
+
+class LayoutProfileException(ValueError): pass
+
+class LayoutProfile():
+	"""A named, precomputed sheet layout. It records the layout options it was
+	computed for along with everything derived from them that does not depend
+	on the photo (canvas and tile dimensions, slot placements and cut mark
+	geometry), so repeated runs with the same layout load it in a single read
+	instead of recomputing it."""
+	_VERSION = 1
+	_OPTIONS = [ "resolution", "picture_type", "border_size", "line_size", "canvas_width", "canvas_height" ]
+
+	def __init__(self, name, options, layout):
+		self._name = name
+		self._options = options
+		self._layout = layout
+
+	@property
+	def name(self):
+		return self._name
+
+	@property
+	def options(self):
+		return self._options
+
+	@property
+	def layout(self):
+		return self._layout
+
+	@classmethod
+	def default_directory(cls):
+		config_home = os.environ.get("XDG_CONFIG_HOME", os.path.expanduser("~/.config"))
+		return os.path.join(config_home, "gbpig", "profiles")
+
+	@classmethod
+	def _filename(cls, directory, name):
+		if (name == "") or (os.sep in name) or name.startswith("."):
+			raise LayoutProfileException("Invalid layout profile name: %s" % (name))
+		return os.path.join(directory, name + ".json")
+
+	@classmethod
+	def from_args(cls, name, args, layout):
+		return cls(name = name, options = { key: getattr(args, key) for key in cls._OPTIONS }, layout = layout)
+
+	@classmethod
+	def available(cls, directory):
+		try:
+			filenames = os.listdir(directory)
+		except FileNotFoundError:
+			return [ ]
+		return sorted(filename[:-5] for filename in filenames if filename.endswith(".json") and (not filename.startswith(".")))
+
+	@classmethod
+	def load(cls, directory, name):
+		try:
+			with open(cls._filename(directory, name)) as f:
+				profile_data = json.load(f)
+		except FileNotFoundError:
+			available = cls.available(directory)
+			if len(available) == 0:
+				raise LayoutProfileException("Unknown layout profile %s, no profiles have been saved in %s." % (name, directory))
+			raise LayoutProfileException("Unknown layout profile %s, available profiles: %s" % (name, ", ".join(available)))
+		if profile_data.get("version") != cls._VERSION:
+			raise LayoutProfileException("Layout profile %s has version %s, but version %d is needed. Save it again." % (name, profile_data.get("version"), cls._VERSION))
+		return cls(name = name, options = profile_data["options"], layout = profile_data["layout"])
+
+	def apply(self, args, defaults = None):
+		"""Sets the layout options of the profile in the argument namespace.
+		If the defaults are given, options that were set to something other
+		than their default and other than the profile's value are rejected
+		instead of being overwritten silently."""
+		if defaults is not None:
+			conflicts = [ "%s %s (profile has %s)" % (key, getattr(args, key), value) for (key, value) in self._options.items() if getattr(args, key) not in [ value, getattr(defaults, key) ] ]
+			if len(conflicts) > 0:
+				raise LayoutProfileException("Layout profile %s conflicts with the given layout options: %s" % (self._name, ", ".join(conflicts)))
+		for (key, value) in self._options.items():
+			setattr(args, key, value)
+
+	def save(self, directory):
+		filename = self._filename(directory, self._name)
+		os.makedirs(directory, exist_ok = True)
+		profile_data = {
+			"version":	self._VERSION,
+			"options":	self._options,
+			"layout":	self._layout,
+		}
+		tmp_filename = filename + ".tmp"
+		with open(tmp_filename, "w") as f:
+			json.dump(profile_data, f)
+		os.replace(tmp_filename, filename)
@@ -21,10 +21,15 @@
 
 import json
 import math
-import subprocess
-from Tools import ImageTools
+import argparse
+from RenderCache import RenderCache
+from StageTimer import StageTimer
+from LayoutProfile import LayoutProfile
+from FriendlyArgumentParser import baseint_unit
 import geo
 
+class PassportGeneratorException(ValueError): pass
+
 class PassportGenerator():
 	_DEFINITIONS = {
 		"adult": {
@@ -40,18 +45,140 @@ class PassportGenerator():
 			"chin-to-head-ideal":	[ 22, 36 ],
 		},
 	}
-	def __init__(self, args):
+	_SOURCE_OVERSAMPLING = 2
+
+	def __init__(self, args, source_cache = None, job_data = None):
 		self._args = args
-		with open(self._args.json_input_filename) as f:
-			self._in = json.load(f)
+		self._source_cache = source_cache
+		self._timer = StageTimer()
+		self._profile = None
+		if self._args.profile is not None:
+			# The profile's layout options replace the default ones, but the
+			# caller's namespace is left untouched
+			self._profile = LayoutProfile.load(self._args.profile_dir, self._args.profile)
+			self._args = argparse.Namespace(**vars(self._args))
+			self._profile.apply(self._args, defaults = self.create_args())
+		if job_data is not None:
+			self._in = job_data
+		else:
+			with open(self._args.json_input_filename) as f:
+				self._in = json.load(f)
+
+	@property
+	def timer(self):
+		return self._timer
+
+	@classmethod
+	def add_arguments(cls, parser, options = None):
+		"""Adds the command line options of the generator to the parser. If
+		options is given, only the options of these names (e.g., "resolution")
+		are added, so that other tools share the options they have in common
+		with gbpig; their defaults can be changed with parser.set_defaults()."""
+		def add(*flags, **kwargs):
+			if (options is None) or (flags[-1].lstrip("-").replace("-", "_") in options):
+				parser.add_argument(*flags, **kwargs)
+
+		add("-r", "--resolution", metavar = "dpi", type = int, default = 300, help = "Output image resolution in dpi. Defaults to %(default)d dpi.")
+		add("-t", "--picture-type", choices = [ "adult", "child" ], default = "adult", help = "Give the picture type. Can be any of %(choices)s, defaults to %(default)s.")
+		add("-b", "--border-size", metavar = "mm", type = float, default = 5, help = "Specifies the dimension around the image that is included (in mm). Defaults to %(default).1f mm.")
+		add("-l", "--line-size", metavar = "mm", type = float, default = 2, help = "Specifies the length of cutting lines in mm. Defaults to %(default).1f mm.")
+		add("-W", "--canvas-width", metavar = "mm", type = float, default = 100, help = "Specifies the output canvas width in mm. Defaults to %(default).1f mm.")
+		add("-H", "--canvas-height", metavar = "mm", type = float, default = 150, help = "Specifies the output canvas height in mm. Defaults to %(default).1f mm.")
+		add("-m", "--render-mode", choices = [ "tile", "slot" ], default = "tile", help = "Determines how the portrait is rendered. 'tile' transforms the source image once and copies the result into every slot, 'slot' transforms the source image separately for every slot. Can be any of %(choices)s, defaults to %(default)s.")
+		add("-B", "--backend", choices = [ "imagemagick", "pillow" ], default = "imagemagick", help = "Selects the rendering backend. 'imagemagick' builds a command line for ImageMagick's convert, 'pillow' renders in-process using Pillow and NumPy. Can be any of %(choices)s, defaults to %(default)s.")
+		add("-c", "--check", action = "store_true", help = "Allows you to check the classification was correct by creating additional help lines.")
+		add("--full-decode", action = "store_true", help = "Decode and transform the whole source image at full resolution instead of only the needed region at the needed resolution.")
+		add("--band-height", metavar = "px", type = int, default = 0, help = "Render the output in horizontal bands of this many pixels and stream them into the output file, which needs to be PNG or TIFF. This bounds memory usage for very large canvases or resolutions and always renders with Pillow. 0 renders the whole canvas at once. Defaults to %(default)d.")
+		add("-p", "--profile", metavar = "name", type = str, help = "Use the named layout profile with its layout options (resolution, picture type, border size, line size and canvas dimensions) and its precomputed layout. Layout options given on the command line that differ from the profile's are rejected.")
+		add("--save-profile", metavar = "name", type = str, help = "Save the layout options of this run along with the layout computed from them as a named layout profile.")
+		add("--profile-dir", metavar = "path", type = str, default = LayoutProfile.default_directory(), help = "Directory in which layout profiles are stored. Defaults to %(default)s.")
+		add("--no-cache", action = "store_true", help = "Do not use the render cache, always render the output.")
+		add("--cache-dir", metavar = "path", type = str, default = RenderCache.default_directory(), help = "Directory in which rendered sheets are cached. Defaults to %(default)s.")
+		add("--cache-size", metavar = "bytes", type = baseint_unit, default = "512Mi", help = "Maximum size of the render cache, least recently used entries are evicted beyond this. Defaults to %(default)s.")
+
+	@classmethod
+	def create_args(cls, **kwargs):
+		"""Returns an argument namespace with the defaults of all options that
+		add_arguments() defines, overridden by the keyword arguments."""
+		parser = argparse.ArgumentParser()
+		cls.add_arguments(parser)
+		args = parser.parse_args([ ])
+		args.verbose = 0
+		args.json_input_filename = None
+		args.image_output_filename = None
+		for (key, value) in kwargs.items():
+			setattr(args, key, value)
+		return args
+
+	@classmethod
+	def coerce_option(cls, key, value, default):
+		"""Converts the value of an option that does not come from the command
+		line (e.g., from a manifest or a service request) to the type of the
+		option's default value and checks that it is acceptable. Raises
+		ValueError otherwise."""
+		if isinstance(default, bool):
+			if not isinstance(value, bool):
+				raise ValueError("Option %s needs a boolean value." % (key))
+		elif isinstance(default, (int, float)):
+			try:
+				if isinstance(value, bool) or (not isinstance(value, (int, float, str))):
+					raise ValueError()
+				converted = type(default)(value)
+			except ValueError:
+				raise ValueError("Option %s needs a numeric value." % (key))
+			if (not isinstance(value, str)) and (converted != value):
+				raise ValueError("Option %s needs an integer value." % (key))
+			value = converted
+		elif (not isinstance(value, str)) and ((value is not None) or (default is not None)):
+			raise ValueError("Option %s needs a string value." % (key))
+
+		choices = {
+			"picture_type":	list(cls._DEFINITIONS),
+			"render_mode":	[ "tile", "slot" ],
+			"backend":		[ "imagemagick", "pillow" ],
+		}
+		if (key in choices) and (value not in choices[key]):
+			raise ValueError("Option %s needs to be any of %s." % (key, ", ".join(choices[key])))
+		return value
+
+	@classmethod
+	def coerce_options(cls, options, excluded = None):
+		"""Checks options that override the defaults of a single job (e.g.,
+		from a manifest or a service request) with coerce_option(). Keys may
+		use dashes instead of underscores. Returns a dictionary keyed by
+		attribute name; raises ValueError for unknown or excluded options and
+		for unacceptable values."""
+		if not isinstance(options, dict):
+			raise ValueError("Options need to be an object.")
+		excluded = [ "json_input_filename", "image_output_filename" ] + list(excluded or [ ])
+		defaults = cls.create_args()
+		coerced = { }
+		for (key, value) in options.items():
+			key = key.replace("-", "_")
+			if (not hasattr(defaults, key)) or (key in excluded):
+				raise ValueError("Unsupported option: %s" % (key))
+			coerced[key] = cls.coerce_option(key, value, getattr(defaults, key))
+		return coerced
+
+	@classmethod
+	def create_renderer(cls, backend, verbose = 0, source_cache = None):
+		if backend == "imagemagick":
+			from Renderer import ImageMagickRenderer
+			return ImageMagickRenderer(verbose = verbose)
+		elif backend == "pillow":
+			from PillowRenderer import PillowRenderer
+			return PillowRenderer(verbose = verbose, source_cache = source_cache)
+		else:
+			raise NotImplementedError(backend)
 
-	def _execute(self, cmd):
-		if self._args.verbose >= 3:
-			print(cmd)
-		subprocess.check_call(cmd)
+	def _create_renderer(self):
+		if self._args.band_height > 0:
+			from BandedRenderer import BandedRenderer
+			return BandedRenderer(band_height = self._args.band_height, resolution = self._args.resolution, verbose = self._args.verbose, source_cache = self._source_cache)
+		return self.create_renderer(self._args.backend, verbose = self._args.verbose, source_cache = self._source_cache)
 
 	def _run_check(self):
-		cmdline = [ "convert", self._in["image"]["filename"] ]
+		self._renderer.open_image(self._in["image"]["filename"])
 		print("Left eye   : %.0f, %.0f" % (self._left_eye.x, self._left_eye.y))
 		print("Right eye  : %.0f, %.0f" % (self._right_eye.x, self._right_eye.y))
 		print("Nose       : %.0f, %.0f" % (self._nose.x, self._nose.y))
@@ -61,15 +188,22 @@ class PassportGenerator():
 		angle_deg = self._angle / math.pi * 180
 		print("Rotation   : %.3f°" % (angle_deg))
 
-		cmdline += ImageTools.imagemagick_draw_circle(center = self._left_eye, radius = 8, stroke = "#ffff00", fill = "none", stroke_width = 1)
-		cmdline += ImageTools.imagemagick_draw_circle(center = self._right_eye, radius = 8, stroke = "#ffff00", fill = "none", stroke_width = 1)
-		cmdline += ImageTools.imagemagick_draw_circle(center = self._nose, radius = 8, stroke = "#00ff00", fill = "none", stroke_width = 1)
-		cmdline += ImageTools.imagemagick_draw_circle(center = self._top, radius = 8, stroke = "#ff0000", fill = "none", stroke_width = 1)
-		cmdline += ImageTools.imagemagick_draw_circle(center = self._chin, radius = 8, stroke = "#ff00ff", fill = "none", stroke_width = 1)
-		cmdline += ImageTools.imagemagick_draw_line(self._left_eye, self._right_eye, stroke = "#ffffff")
-		cmdline += ImageTools.imagemagick_draw_line(self._top, self._chin, stroke = "#ffffff")
-		cmdline += [ self._args.image_output_filename ]
-		self._execute(cmdline)
+		self._place_poi_marks()
+		self._renderer.write(self._args.image_output_filename)
+
+	def _place_poi_marks(self, affine = None):
+		# The affine maps source image coordinates onto the canvas if the
+		# canvas is not the source image itself
+		(left_eye, right_eye, nose, top, chin) = (self._left_eye, self._right_eye, self._nose, self._top, self._chin)
+		if affine is not None:
+			(left_eye, right_eye, nose, top, chin) = (affine.transform(point) for point in (left_eye, right_eye, nose, top, chin))
+		self._renderer.draw_circle(center = left_eye, radius = 8, stroke = "#ffff00", fill = "none", stroke_width = 1)
+		self._renderer.draw_circle(center = right_eye, radius = 8, stroke = "#ffff00", fill = "none", stroke_width = 1)
+		self._renderer.draw_circle(center = nose, radius = 8, stroke = "#00ff00", fill = "none", stroke_width = 1)
+		self._renderer.draw_circle(center = top, radius = 8, stroke = "#ff0000", fill = "none", stroke_width = 1)
+		self._renderer.draw_circle(center = chin, radius = 8, stroke = "#ff00ff", fill = "none", stroke_width = 1)
+		self._renderer.draw_line(left_eye, right_eye, stroke = "#ffffff")
+		self._renderer.draw_line(top, chin, stroke = "#ffffff")
 
 	def _to_px(self, input_value, input_unit = "mm"):
 		if input_unit == "mm":
@@ -121,129 +255,222 @@ class PassportGenerator():
 	def _compute_top_to_eyes(self):
 		return self._to_px((self._definitions["top-to-eyes"][0] + self._definitions["top-to-eyes"][1]) / 2)
 
-	def _place_debug_marks(self, placement_at_mm):
-		cmdline = [ ]
-		image_pos = placement_at_mm + geo.Vector2d(self._args.line_size + self._args.border_size, self._args.line_size + self._args.border_size)
+	def _place_debug_marks(self, slot_px):
+		image_pos = geo.Vector2d(slot_px[0] + self._slot_template["image_offset_px"], slot_px[1] + self._slot_template["image_offset_px"])
+		image_dimension_px = self._slot_template["image_dimension_px"]
 
 		# White rectangle outlining the actual image
-		cmdline += ImageTools.imagemagick_draw_rectangle(geo.Box2d(base = self._to_px(image_pos), dimensions = self._to_px(self._image_dimension_mm)), stroke = "#ffffff")
+		self._renderer.draw_rectangle(geo.Box2d(base = image_pos, dimensions = image_dimension_px), stroke = "#ffffff")
 
 		# Draw eye line
 		eye_height_mm = self._definitions["top-to-eyes"][1] - self._definitions["top-to-eyes"][0]
-		cmdline += ImageTools.imagemagick_draw_rectangle(geo.Box2d(base = self._to_px(image_pos + geo.Vector2d(0, self._definitions["top-to-eyes"][0])), dimensions = self._to_px(geo.Vector2d(self._image_dimension_mm.x, eye_height_mm))), fill = "#ff000040", stroke = None)
+		self._renderer.draw_rectangle(geo.Box2d(base = image_pos + geo.Vector2d(0, self._to_px(self._definitions["top-to-eyes"][0])), dimensions = geo.Vector2d(image_dimension_px.x, self._to_px(eye_height_mm))), fill = "#ff000040", stroke = None)
 
 		# Draw nose line
 		nose_width_mm = self._definitions["left-to-nose"][1] - self._definitions["left-to-nose"][0]
 		start_at_mm = self._definitions["top-to-eyes"][0]
-		cmdline += ImageTools.imagemagick_draw_rectangle(geo.Box2d(base = self._to_px(image_pos + geo.Vector2d(self._definitions["left-to-nose"][0], start_at_mm)), dimensions = self._to_px(geo.Vector2d(nose_width_mm, self._image_dimension_mm.y - start_at_mm))), fill = "#ff000040", stroke = None)
+		self._renderer.draw_rectangle(geo.Box2d(base = image_pos + self._to_px(geo.Vector2d(self._definitions["left-to-nose"][0], start_at_mm)), dimensions = self._to_px(geo.Vector2d(nose_width_mm, self._image_dimension_mm.y - start_at_mm))), fill = "#ff000040", stroke = None)
 
-		# Draw chin and head lines
-		chin = self._affine.transform(self._chin)
-		top = self._affine.transform(self._top)
+		# Draw chin and head lines; their position within the tile is known,
+		# only the tile's offset differs between slots
+		(tile_x, tile_y) = self._tile_origin_px(slot_px)
+		chin = geo.Vector2d(tile_x + self._tile_chin_px.x, tile_y + self._tile_chin_px.y)
+		top = geo.Vector2d(tile_x + self._tile_top_px.x, tile_y + self._tile_top_px.y)
 		space = self._to_px(1)
 
 		# Line at chin
-		cmdline += ImageTools.imagemagick_draw_relline(geo.Vector2d(self._to_px(image_pos).x, chin.y), self._to_px(geo.Vector2d(self._image_dimension_mm.x, 0)), stroke = "#ff0000")
+		self._renderer.draw_relline(geo.Vector2d(image_pos.x, chin.y), geo.Vector2d(image_dimension_px.x, 0), stroke = "#ff0000")
 
 		# Line at top of head
-		cmdline += ImageTools.imagemagick_draw_relline(geo.Vector2d(self._to_px(image_pos).x, top.y), self._to_px(geo.Vector2d(self._image_dimension_mm.x, 0)), stroke = "#ff0000")
+		self._renderer.draw_relline(geo.Vector2d(image_pos.x, top.y), geo.Vector2d(image_dimension_px.x, 0), stroke = "#ff0000")
 
 		# Horizontal arrow connecting the two
-		cmdline += ImageTools.imagemagick_draw_arrow(geo.Vector2d(self._to_px(image_pos).x + space, chin.y), geo.Vector2d(self._to_px(image_pos).x + space, top.y), stroke = "#cccccc")
+		self._renderer.draw_arrow(geo.Vector2d(image_pos.x + space, chin.y), geo.Vector2d(image_pos.x + space, top.y), stroke = "#cccccc")
 
 		size_mm = (chin.y - top.y) / self._args.resolution * 25.4
 		if self._definitions["chin-to-head-ideal"][0] <= size_mm <= self._definitions["chin-to-head-ideal"][1]:
 			color = "green"
 			text = "OK"
-		elif self._definitions["chin-to-head-ideal"][0] <= size_mm <= self._definitions["chin-to-head-ideal"][1]:
+		elif self._definitions["chin-to-head"][0] <= size_mm <= self._definitions["chin-to-head"][1]:
 			color = "yellow"
 			text = "borderline"
 		else:
 			color = "red"
 			text = "illegal"
-		cmdline += ImageTools.imagemagick_draw_text(self._to_px(image_pos + geo.Vector2d(0, -1)), "Head-to-chin: %.1f mm (%s)" % (size_mm, text), color = color, font_size = 16)
-
-		return cmdline
-
-	def _place_image(self, placement_at_mm):
-		if self._args.verbose >= 3:
-			print("Placing image at %.1fmm / %.1fmm" % (placement_at_mm[0], placement_at_mm[1]))
-		cmdline = [ ]
-		placement_at_px = self._to_px(placement_at_mm + geo.Vector2d(self._args.line_size, self._args.line_size))
+		self._renderer.draw_text(image_pos - geo.Vector2d(0, space), "Head-to-chin: %.1f mm (%s)" % (size_mm, text), color = color, font_size = 16)
 
+	def _compute_tile_affine(self):
 		# Scale and rotate first
-		self._affine = geo.TransformationMatrix.scale(self._image_scale) * geo.TransformationMatrix.rotate(self._angle)
+		affine = geo.TransformationMatrix.scale(self._image_scale) * geo.TransformationMatrix.rotate(self._angle)
 
 		# Center nose horizontally
-		current_nose = self._affine.transform(self._nose)
-		self._affine = self._affine * geo.TransformationMatrix.translate(geo.Vector2d(-current_nose.x, 0))
-		self._affine = self._affine * geo.TransformationMatrix.translate(geo.Vector2d(self._bordered_image_dimension_px.x / 2, 0))
+		current_nose = affine.transform(self._nose)
+		affine = affine * geo.TransformationMatrix.translate(geo.Vector2d(-current_nose.x, 0))
+		affine = affine * geo.TransformationMatrix.translate(geo.Vector2d(self._bordered_image_dimension_px.x / 2, 0))
 
 		# Lineup eyes vertically
-		current_left_eye = self._affine.transform(self._left_eye)
-		self._affine = self._affine * geo.TransformationMatrix.translate(geo.Vector2d(0, -current_left_eye.y + self._image_border_px + self._top_to_eyes_px))
-
-		# Shift by image placement
-		self._affine = self._affine * geo.TransformationMatrix.translate(placement_at_px)
-
-		cropbox = geo.Box2d(base = placement_at_px, dimensions = self._to_px(self._bordered_image_dimension_mm))
-		inner_cropbox = geo.Box2d(base = placement_at_px + geo.Vector2d(self._image_border_px, self._image_border_px), dimensions = self._to_px(self._image_dimension_mm))
-		cmdline += ImageTools.imagemagick_blit(self._in["image"]["filename"], self._affine, cropbox)
-		return cmdline
-
-	def _place_cutmarks(self, placement_at_mm):
-		cmdline = [ ]
-
-		# Bordered image top left
-		cmdline += ImageTools.imagemagick_draw_relline(self._to_px(placement_at_mm + geo.Vector2d(self._args.line_size, self._args.line_size)), self._to_px(geo.Vector2d(-self._args.line_size, 0)), stroke = "#000000")
-		cmdline += ImageTools.imagemagick_draw_relline(self._to_px(placement_at_mm + geo.Vector2d(self._args.line_size, self._args.line_size)), self._to_px(geo.Vector2d(0, -self._args.line_size)), stroke = "#000000")
-
-		# Bordered image bottom left
-		cmdline += ImageTools.imagemagick_draw_relline(self._to_px(placement_at_mm + geo.Vector2d(self._args.line_size, self._outlined_image_dimension_mm.y - self._args.line_size)), self._to_px(geo.Vector2d(-self._args.line_size, 0)), stroke = "#000000")
-		cmdline += ImageTools.imagemagick_draw_relline(self._to_px(placement_at_mm + geo.Vector2d(self._args.line_size, self._outlined_image_dimension_mm.y - self._args.line_size)), self._to_px(geo.Vector2d(0, self._args.line_size)), stroke = "#000000")
-
-		# Bordered image top right
-		cmdline += ImageTools.imagemagick_draw_relline(self._to_px(placement_at_mm + geo.Vector2d(self._outlined_image_dimension_mm.x - self._args.line_size, self._args.line_size)), self._to_px(geo.Vector2d(self._args.line_size, 0)), stroke = "#000000")
-		cmdline += ImageTools.imagemagick_draw_relline(self._to_px(placement_at_mm + geo.Vector2d(self._outlined_image_dimension_mm.x - self._args.line_size, self._args.line_size)), self._to_px(geo.Vector2d(0, -self._args.line_size)), stroke = "#000000")
-
-		# Bordered image bottom right
-		cmdline += ImageTools.imagemagick_draw_relline(self._to_px(placement_at_mm + self._outlined_image_dimension_mm - geo.Vector2d(self._args.line_size, self._args.line_size)), self._to_px(geo.Vector2d(self._args.line_size, 0)), stroke = "#000000")
-		cmdline += ImageTools.imagemagick_draw_relline(self._to_px(placement_at_mm + self._outlined_image_dimension_mm - geo.Vector2d(self._args.line_size, self._args.line_size)), self._to_px(geo.Vector2d(0, self._args.line_size)), stroke = "#000000")
-
-		# Inner image top left
-		cmdline += ImageTools.imagemagick_draw_relline(self._to_px(placement_at_mm + geo.Vector2d(self._args.line_size, self._args.line_size + self._args.border_size)), self._to_px(geo.Vector2d(-self._args.line_size, 0)), stroke = "#000000")
-		cmdline += ImageTools.imagemagick_draw_relline(self._to_px(placement_at_mm + geo.Vector2d(self._args.line_size + self._args.border_size, self._args.line_size)), self._to_px(geo.Vector2d(0, -self._args.line_size)), stroke = "#000000")
-
-		# Inner image bottom left
-		cmdline += ImageTools.imagemagick_draw_relline(self._to_px(placement_at_mm + geo.Vector2d(self._args.line_size, self._outlined_image_dimension_mm.y - self._args.line_size - self._args.border_size)), self._to_px(geo.Vector2d(-self._args.line_size, 0)), stroke = "#000000")
-		cmdline += ImageTools.imagemagick_draw_relline(self._to_px(placement_at_mm + geo.Vector2d(self._args.line_size + self._args.border_size, self._outlined_image_dimension_mm.y - self._args.line_size)), self._to_px(geo.Vector2d(0, self._args.line_size)), stroke = "#000000")
-
-		# Inner image top right
-		cmdline += ImageTools.imagemagick_draw_relline(self._to_px(placement_at_mm + geo.Vector2d(self._outlined_image_dimension_mm.x - self._args.line_size, self._args.line_size + self._args.border_size)), self._to_px(geo.Vector2d(self._args.line_size, 0)), stroke = "#000000")
-		cmdline += ImageTools.imagemagick_draw_relline(self._to_px(placement_at_mm + geo.Vector2d(self._outlined_image_dimension_mm.x - self._args.line_size - self._args.border_size, self._args.line_size)), self._to_px(geo.Vector2d(0, -self._args.line_size)), stroke = "#000000")
-
-		# Inner image bottom right
-		cmdline += ImageTools.imagemagick_draw_relline(self._to_px(placement_at_mm + self._outlined_image_dimension_mm - geo.Vector2d(self._args.line_size, self._args.line_size + self._args.border_size)), self._to_px(geo.Vector2d(self._args.line_size, 0)), stroke = "#000000")
-		cmdline += ImageTools.imagemagick_draw_relline(self._to_px(placement_at_mm + self._outlined_image_dimension_mm - geo.Vector2d(self._args.line_size + self._args.border_size, self._args.line_size)), self._to_px(geo.Vector2d(0, self._args.line_size)), stroke = "#000000")
+		current_left_eye = affine.transform(self._left_eye)
+		affine = affine * geo.TransformationMatrix.translate(geo.Vector2d(0, -current_left_eye.y + self._image_border_px + self._top_to_eyes_px))
+		return affine
+
+	def _compute_source_region(self, image_geometry):
+		if self._args.full_decode:
+			return None
+
+		from Tools import ImageTools
+		from Renderer import SourceRegion
+
+		# Find the part of the source image that ends up on the bordered tile
+		(ia, ib, ic, id, ie, if_) = ImageTools.inverse_affine_coefficients(ImageTools.affine_coefficients(self._tile_affine))
+		tile_corners = [ (0, 0), (self._bordered_image_dimension_px.x, 0), (0, self._bordered_image_dimension_px.y), (self._bordered_image_dimension_px.x, self._bordered_image_dimension_px.y) ]
+		source_corners = [ ((ia * x) + (ib * y) + ic, (id * x) + (ie * y) + if_) for (x, y) in tile_corners ]
+		source_min = (min(x for (x, y) in source_corners), min(y for (x, y) in source_corners))
+		source_max = (max(x for (x, y) in source_corners), max(y for (x, y) in source_corners))
+
+		# Decode at a multiple of the resolution the output needs, but never
+		# upscale
+		scale = min(1, self._image_scale * self._SOURCE_OVERSAMPLING)
+		region = SourceRegion.from_source_box(image_geometry, scale, source_min, source_max)
+		if (region.scale == 1) and (region.crop == (0, 0, image_geometry[0], image_geometry[1])):
+			return None
+		if self._args.verbose >= 2:
+			print("Decoding source region: %s" % (region))
+		return region
+
+	def _compute_slot_template(self):
+		"""Precomputes everything about a slot that does not depend on where
+		the slot is placed. Offsets are in pixels, relative to the top left
+		corner of the slot (i.e., of the outlined image)."""
+		line = self._to_px(self._args.line_size)
+		border = self._to_px(self._args.border_size)
+		width = self._to_px(self._outlined_image_dimension_mm.x)
+		height = self._to_px(self._outlined_image_dimension_mm.y)
+		return {
+			"tile_offset_px":		line,
+			"image_offset_px":		line + border,
+			"image_dimension_px":	self._to_px(self._image_dimension_mm),
+
+			# Cut marks as (x1, y1, x2, y2) segments
+			"cutmarks_px": [
+				# Bordered image top left, bottom left, top right, bottom right
+				(line, line, 0, line),
+				(line, line, line, 0),
+				(line, height - line, 0, height - line),
+				(line, height - line, line, height),
+				(width - line, line, width, line),
+				(width - line, line, width - line, 0),
+				(width - line, height - line, width, height - line),
+				(width - line, height - line, width - line, height),
+
+				# Inner image top left, bottom left, top right, bottom right
+				(line, line + border, 0, line + border),
+				(line + border, line, line + border, 0),
+				(line, height - line - border, 0, height - line - border),
+				(line + border, height - line, line + border, height),
+				(width - line, line + border, width, line + border),
+				(width - line - border, line, width - line - border, 0),
+				(width - line, height - line - border, width, height - line - border),
+				(width - line - border, height - line, width - line - border, height),
+			],
+		}
+
+	def _get_slots_px(self):
+		return [ (self._to_px(placement_at_mm.x), self._to_px(placement_at_mm.y)) for placement_at_mm in self._get_image_placements() ]
+
+	def _tile_origin_px(self, slot_px):
+		x = slot_px[0] + self._slot_template["tile_offset_px"]
+		y = slot_px[1] + self._slot_template["tile_offset_px"]
+		if self._args.render_mode == "tile":
+			# Tiles can only be composited at integer offsets
+			(x, y) = (round(x), round(y))
+		return (x, y)
+
+	def _place_image(self, slot_px):
+		if self._args.verbose >= 3:
+			print("Placing image at %.0f / %.0f px" % (slot_px[0], slot_px[1]))
+		tile_origin_px = geo.Vector2d(*self._tile_origin_px(slot_px))
+		if self._args.render_mode == "tile":
+			self._renderer.place_tile("portrait", tile_origin_px)
+		else:
+			affine = self._tile_affine * geo.TransformationMatrix.translate(tile_origin_px)
+			cropbox = geo.Box2d(base = tile_origin_px, dimensions = self._bordered_image_dimension_px)
+			self._renderer.blit(self._in["image"]["filename"], affine, cropbox, region = self._source_region)
 
-		return cmdline
+	def _place_cutmarks(self, slots_px):
+		# Translate the template to every slot and draw everything in one batch
+		segments = [ (x + x1, y + y1, x + x2, y + y2) for (x, y) in slots_px for (x1, y1, x2, y2) in self._slot_template["cutmarks_px"] ]
+		self._renderer.draw_lines(segments, stroke = "#000000")
 
 	def _create_image(self):
-		cmdline = [ "convert", "-size", "%.0fx%.0f" % (self._dimension_canvas_px.x, self._dimension_canvas_px.y), "xc:yellow" if self._args.check else "xc:white" ]
+		self._renderer.new_canvas(self._dimension_canvas_px, "yellow" if self._args.check else "white")
+		if self._args.render_mode == "tile":
+			# Transform the portrait only once, every slot receives a copy
+			self._renderer.render_tile("portrait", self._in["image"]["filename"], self._tile_affine, self._bordered_image_dimension_px, region = self._source_region)
+		for slot_px in self._slots_px:
+			self._place_image(slot_px)
+
+		# All primitives come after compositing, so that they are drawn in a
+		# single pass
 		text = "Target size: %.0f x %.0f mm, definitions for %s. Inner image %.0f x %.0fmm, bordered image %.0f x %.0fmm. Border size %.0f mm, cutmarks %.0fmm. %d dpi." % (self._dimension_canvas_mm.x, self._dimension_canvas_mm.y, self._args.picture_type, self._image_dimension_mm.x, self._image_dimension_mm.y, self._bordered_image_dimension_mm.x, self._bordered_image_dimension_mm.y, self._args.border_size, self._args.line_size, self._args.resolution)
-		cmdline += ImageTools.imagemagick_draw_text(self._to_px(geo.Vector2d(2, 2)) + geo.Vector2d(0, 16), text, color = "#000000", font_size = 16)
-		for placement_at_mm in self._get_image_placements():
-			cmdline += self._place_image(placement_at_mm)
-			cmdline += self._place_cutmarks(placement_at_mm)
-			if self._args.check:
-				cmdline += self._place_debug_marks(placement_at_mm)
-		cmdline += [ self._args.image_output_filename ]
-		self._execute(cmdline)
-
-	def _compute_geometry(self):
+		self._renderer.draw_text(self._to_px(geo.Vector2d(2, 2)) + geo.Vector2d(0, 16), text, color = "#000000", font_size = 16)
+		self._place_cutmarks(self._slots_px)
+		if self._args.check:
+			for slot_px in self._slots_px:
+				self._place_debug_marks(slot_px)
+
+	def _compute_layout(self):
+		"""Computes everything about the sheet that only depends on the layout
+		options, not on the photo. The result is what a layout profile
+		stores."""
+		self._dimension_canvas_mm = geo.Vector2d(self._args.canvas_width, self._args.canvas_height)
+		self._image_dimension_mm = geo.Vector2d(35, 45)
+		self._bordered_image_dimension_mm = self._image_dimension_mm + (2 * geo.Vector2d(self._args.border_size, self._args.border_size))
+		self._outlined_image_dimension_mm = self._bordered_image_dimension_mm + (2 * geo.Vector2d(self._args.line_size, self._args.line_size))
+		if self._args.verbose >= 2:
+			print("Dimensions in mm:")
+			print("Canvas        : %s" % (str(self._dimension_canvas_mm)))
+			print("Image         : %s" % (str(self._image_dimension_mm)))
+			print("Bordered image: %s" % (str(self._bordered_image_dimension_mm)))
+			print("Outlined image: %s" % (str(self._outlined_image_dimension_mm)))
+
+		dimension_canvas_px = self._to_px(self._dimension_canvas_mm)
+		bordered_image_dimension_px = self._to_px(self._bordered_image_dimension_mm)
+		slot_template = self._compute_slot_template()
+		return {
+			"canvas_mm":			[ self._dimension_canvas_mm.x, self._dimension_canvas_mm.y ],
+			"image_mm":				[ self._image_dimension_mm.x, self._image_dimension_mm.y ],
+			"bordered_image_mm":	[ self._bordered_image_dimension_mm.x, self._bordered_image_dimension_mm.y ],
+			"outlined_image_mm":	[ self._outlined_image_dimension_mm.x, self._outlined_image_dimension_mm.y ],
+			"canvas_px":			[ dimension_canvas_px.x, dimension_canvas_px.y ],
+			"bordered_image_px":	[ bordered_image_dimension_px.x, bordered_image_dimension_px.y ],
+			"image_border_px":		self._to_px(self._args.border_size),
+			"top_to_eyes_px":		self._compute_top_to_eyes(),
+			"slots_px":				self._get_slots_px(),
+			"slot_template":		dict(slot_template, image_dimension_px = [ slot_template["image_dimension_px"].x, slot_template["image_dimension_px"].y ]),
+		}
+
+	def _apply_layout(self, layout):
+		self._dimension_canvas_mm = geo.Vector2d(*layout["canvas_mm"])
+		self._image_dimension_mm = geo.Vector2d(*layout["image_mm"])
+		self._bordered_image_dimension_mm = geo.Vector2d(*layout["bordered_image_mm"])
+		self._outlined_image_dimension_mm = geo.Vector2d(*layout["outlined_image_mm"])
+		self._dimension_canvas_px = geo.Vector2d(*layout["canvas_px"])
+		self._bordered_image_dimension_px = geo.Vector2d(*layout["bordered_image_px"])
+		self._image_border_px = layout["image_border_px"]
+		self._top_to_eyes_px = layout["top_to_eyes_px"]
+		self._slots_px = [ tuple(slot_px) for slot_px in layout["slots_px"] ]
+		self._slot_template = dict(layout["slot_template"], image_dimension_px = geo.Vector2d(*layout["slot_template"]["image_dimension_px"]))
+
+	def _get_image_geometry(self):
+		from Tools import ImageTools
 		image_geometry = ImageTools.get_image_geometry(self._in["image"]["filename"])
 		if ("geometry" in self._in["image"]) and (image_geometry != tuple(self._in["image"]["geometry"])):
 			print("Warning: Image geometry have changed. Classified image is supposed to be %d x %d, but actual image has %d x %d pixels." % (self._in["image"]["geometry"][0], self._in["image"]["geometry"][1], image_geometry[0], image_geometry[1]))
+		return image_geometry
+
+	def _compute_geometry(self, image_geometry = None):
+		if image_geometry is None:
+			image_geometry = self._get_image_geometry()
 
 		self._left_eye = geo.Vector2d(self._in["pois"]["left_eye"][0], self._in["pois"]["left_eye"][1])
 		self._right_eye = geo.Vector2d(self._in["pois"]["right_eye"][0], self._in["pois"]["right_eye"][1])
@@ -268,25 +495,77 @@ class PassportGenerator():
 			print("    Chin      : %s" % (str(self._chin)))
 			print("    Rotation  : %.2f°" % (self._angle * 180 / math.pi))
 
-		self._dimension_canvas_mm = geo.Vector2d(self._args.canvas_width, self._args.canvas_height)
-		self._image_dimension_mm = geo.Vector2d(35, 45)
-		self._bordered_image_dimension_mm = self._image_dimension_mm + (2 * geo.Vector2d(self._args.border_size, self._args.border_size))
-		self._outlined_image_dimension_mm = self._bordered_image_dimension_mm + (2 * geo.Vector2d(self._args.line_size, self._args.line_size))
-		if self._args.verbose >= 2:
-			print("Dimensions in mm:")
-			print("Canvas        : %s" % (str(self._dimension_canvas_mm)))
-			print("Image         : %s" % (str(self._image_dimension_mm)))
-			print("Bordered image: %s" % (str(self._bordered_image_dimension_mm)))
-			print("Outlined image: %s" % (str(self._outlined_image_dimension_mm)))
-
-		self._dimension_canvas_px = self._to_px(self._dimension_canvas_mm)
-		self._bordered_image_dimension_px = self._to_px(self._bordered_image_dimension_mm)
-		self._image_border_px = self._to_px(self._args.border_size)
+		if self._profile is not None:
+			self._apply_layout(self._profile.layout)
+		else:
+			self._apply_layout(self._compute_layout())
 
 		self._image_scale = self._compute_scale_factor()
-		self._top_to_eyes_px = self._compute_top_to_eyes()
+		self._tile_affine = self._compute_tile_affine()
+		self._source_region = self._compute_source_region(image_geometry)
+		self._tile_chin_px = self._tile_affine.transform(self._chin)
+		self._tile_top_px = self._tile_affine.transform(self._top)
+
+	def compute_source_region(self):
+		"""Returns the region of the source image that rendering needs to
+		decode, e.g., to reserve it in a shared SourceCache before any job
+		decodes. None stands for the whole image at full resolution."""
+		self._definitions = self._DEFINITIONS[self._args.picture_type]
+		self._compute_geometry()
+		return self._source_region
 
-	def run(self):
+	def render_tile(self, renderer, name):
+		"""Renders only the bordered portrait into a named tile of the given
+		renderer, so that callers can lay out sheets themselves. Returns the
+		dimensions of the tile in pixels."""
 		self._definitions = self._DEFINITIONS[self._args.picture_type]
+		self._renderer = renderer
 		self._compute_geometry()
-		self._create_image()
+		self._renderer.render_tile(name, self._in["image"]["filename"], self._tile_affine, self._bordered_image_dimension_px, region = self._source_region)
+		return geo.Vector2d(round(self._bordered_image_dimension_px.x), round(self._bordered_image_dimension_px.y))
+
+	def _get_cache_key(self):
+		layout = { key: getattr(self._args, key) for key in [ "resolution", "picture_type", "border_size", "line_size", "canvas_width", "canvas_height", "render_mode", "backend", "check", "full_decode", "band_height" ] }
+		return RenderCache.compute_key(self._in["image"]["filename"], self._in["pois"], self._definitions, layout)
+
+	def _run_stages(self):
+		if not self._args.no_cache:
+			with self._timer.stage("cache lookup"):
+				render_cache = RenderCache(self._args.cache_dir, self._args.cache_size, verbose = self._args.verbose)
+				cache_key = self._get_cache_key()
+				cache_hit = render_cache.fetch(cache_key, self._args.image_output_filename)
+			if cache_hit:
+				return
+
+		with self._timer.stage("image geometry"):
+			image_geometry = self._get_image_geometry()
+		with self._timer.stage("geometry"):
+			self._compute_geometry(image_geometry)
+		with self._timer.stage("build"):
+			self._renderer = self._create_renderer()
+			self._create_image()
+		with self._timer.stage("render"):
+			self._renderer.write(self._args.image_output_filename)
+
+		if not self._args.no_cache:
+			with self._timer.stage("cache store"):
+				render_cache.store(cache_key, self._args.image_output_filename)
+
+	def _check_output_filename(self):
+		if self._args.band_height > 0:
+			# Fail before any work is done, not when the first band is written
+			from StreamWriter import StreamWriter
+			if not StreamWriter.supports(self._args.image_output_filename):
+				raise PassportGeneratorException("Rendering in bands (--band-height) needs a PNG or TIFF output file, not %s." % (self._args.image_output_filename))
+
+	def run(self):
+		self._check_output_filename()
+		self._definitions = self._DEFINITIONS[self._args.picture_type]
+		if self._args.save_profile is not None:
+			self._profile = LayoutProfile.from_args(self._args.save_profile, self._args, self._compute_layout())
+			self._profile.save(self._args.profile_dir)
+			if self._args.verbose >= 1:
+				print("Saved layout profile %s to %s" % (self._profile.name, self._args.profile_dir))
+		self._run_stages()
+		if self._args.verbose >= 3:
+			self._timer.dump()
@@ -0,0 +1,81 @@
+#	gbpig - German Biometric Passport Image Generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of gbpig.
+#
+#	gbpig is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	gbpig is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with gbpig; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+import copy
+from PIL import Image
+from PassportGenerator import PassportGenerator
+from PillowRenderer import SourceCache
+from Renderer import SourceRegion
+
+class PassportPreview(PassportGenerator):
+	"""Renders a single slot including the debug overlay at screen resolution,
+	along with the POI annotations on the source image. The source is decoded
+	and downscaled only once, so repeated calls to render() with modified POIs
+	are cheap."""
+	def __init__(self, job_data, resolution = 100, picture_type = "adult", border_size = 5, line_size = 2, source_cache = None, verbose = 0):
+		args = PassportGenerator.create_args(resolution = resolution, picture_type = picture_type, border_size = border_size, line_size = line_size, backend = "pillow", render_mode = "tile", check = True, no_cache = True, verbose = verbose)
+		super().__init__(args, source_cache = source_cache if (source_cache is not None) else SourceCache(), job_data = copy.deepcopy(job_data))
+		self._definitions = self._DEFINITIONS[picture_type]
+		self._renderer = self._create_renderer()
+		self._preview_region = None
+
+	@property
+	def pois(self):
+		return self._in["pois"]
+
+	def _compute_source_region(self, image_geometry):
+		# Decode the whole source once at a resolution suitable for the first
+		# preview and keep it, even when changed POIs change the scale
+		if self._preview_region is None:
+			scale = min(1, self._image_scale * self._SOURCE_OVERSAMPLING)
+			self._preview_region = SourceRegion.from_source_box(image_geometry, scale, (0, 0), image_geometry, margin = 0)
+			if self._args.verbose >= 2:
+				print("Preview source region: %s" % (self._preview_region))
+		return self._preview_region
+
+	def render(self, pois = None):
+		"""Updates the given POIs and returns a tuple of PIL images: the
+		rendered slot and the annotated source image."""
+		if pois is not None:
+			self._in["pois"].update(pois)
+		self._compute_geometry()
+
+		self._renderer.new_canvas(self._to_px(self._outlined_image_dimension_mm), "yellow")
+		self._renderer.render_tile("portrait", self._in["image"]["filename"], self._tile_affine, self._bordered_image_dimension_px, region = self._source_region)
+		slot_px = (0, 0)
+		self._place_image(slot_px)
+		self._place_cutmarks([ slot_px ])
+		self._place_debug_marks(slot_px)
+		slot = self._renderer.finish()
+
+		self._renderer.open_region(self._in["image"]["filename"], self._source_region)
+		self._place_poi_marks(affine = self._source_region.inverse_affine)
+		annotated_source = self._renderer.finish()
+		return (slot, annotated_source)
+
+	def render_combined(self, pois = None):
+		"""Like render(), but returns both images side by side in one image."""
+		(slot, annotated_source) = self.render(pois)
+		combined = Image.new("RGB", (slot.width + annotated_source.width, max(slot.height, annotated_source.height)), "white")
+		combined.paste(slot, (0, 0))
+		combined.paste(annotated_source, (slot.width, 0))
+		return combined
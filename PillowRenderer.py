@@ -0,0 +1,290 @@
+#	gbpig - German Biometric Passport Image Generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of gbpig.
+#
+#	gbpig is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	gbpig is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with gbpig; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+import math
+import threading
+import collections
+import numpy
+from PIL import Image, ImageDraw, ImageFont
+from Renderer import Renderer
+from Tools import ImageTools
+import geo
+
+class DecodedSource():
+	"""One decode of a source image along with box-filtered reductions of it.
+	The region is the one that was actually decoded, which may be larger than
+	the one that was asked for."""
+	def __init__(self, infile, region):
+		self._infile = infile
+		self._region = region
+		self._lock = threading.Lock()
+		self._pixels = { }
+
+	@property
+	def region(self):
+		return self._region
+
+	def covers(self, region):
+		# No region stands for the whole image at full resolution
+		return (self._region is None) or ((region is not None) and self._region.covers(region))
+
+	def pixels(self, reduction = 1):
+		# Concurrent users of the same source wait for a single decode
+		with self._lock:
+			if 1 not in self._pixels:
+				self._pixels[1] = SourceCache.decode(self._infile, self._region)
+			if reduction not in self._pixels:
+				# Reduced versions derive from the full decode, so that the
+				# file is only decoded once
+				self._pixels[reduction] = SourceCache.reduce(self._pixels[1], reduction)
+			return self._pixels[reduction]
+
+class SourceCache():
+	"""Keeps one decode per source image around so that several renderings
+	from the same source only decode it once, even if they need different
+	regions of it: a decode is shared by all requests that it covers. A request
+	that is not covered replaces the decode by one of the union of both
+	regions, so that the decode only grows until it covers all requests.
+	Callers that know their requests in advance can reserve() all of their
+	regions before the first decode to get by with a single one. Safe to
+	share between threads."""
+	def __init__(self, capacity = 4):
+		self._capacity = capacity
+		self._lock = threading.Lock()
+		self._entries = collections.OrderedDict()
+
+	@staticmethod
+	def _pad(image):
+		# One pixel of transparent padding makes bilinear lookups at the
+		# image edges fade out the same way ImageMagick's transparent
+		# virtual pixels do.
+		pixels = numpy.zeros((image.height + 2, image.width + 2, 4), dtype = numpy.uint8)
+		pixels[1 : -1, 1 : -1] = numpy.asarray(image)
+		return pixels
+
+	@classmethod
+	def decode(cls, infile, region):
+		image = Image.open(infile)
+		if region is not None:
+			# Let the JPEG decoder do most of the downscaling in the DCT
+			# domain, then resample only the region of interest.
+			image.draft("RGB", region.scaled_size)
+			(x, y, width, height) = region.crop
+			(factor_x, factor_y) = (image.width / region.scaled_size[0], image.height / region.scaled_size[1])
+			box = (x * factor_x, y * factor_y, (x + width) * factor_x, (y + height) * factor_y)
+			image = image.resize((width, height), resample = Image.LANCZOS, box = box).convert("RGBA")
+		else:
+			image = image.convert("RGBA")
+		return cls._pad(image)
+
+	@classmethod
+	def reduce(cls, pixels, reduction):
+		return cls._pad(Image.fromarray(pixels[1 : -1, 1 : -1], "RGBA").reduce(reduction))
+
+	def _lookup(self, infile, region):
+		# Needs to be called with the lock held
+		entry = self._entries.get(infile)
+		if entry is None:
+			entry = DecodedSource(infile, region)
+		elif not entry.covers(region):
+			# Users of the previous decode keep their reference to it
+			entry = DecodedSource(infile, None if ((region is None) or (entry.region.image_size != region.image_size)) else entry.region.union(region))
+		self._entries[infile] = entry
+		self._entries.move_to_end(infile)
+		while len(self._entries) > self._capacity:
+			self._entries.popitem(last = False)
+		return entry
+
+	def reserve(self, infile, region = None):
+		"""Announces that the region of the source will be needed, without
+		decoding anything yet."""
+		with self._lock:
+			self._lookup(infile, region)
+
+	def get(self, infile, region = None):
+		"""Returns a DecodedSource whose region covers the given one. The
+		actual decode happens outside the global lock on the first access to
+		its pixels, so that different sources decode in parallel."""
+		with self._lock:
+			return self._lookup(infile, region)
+
+class PillowRenderer(Renderer):
+	_RESAMPLE_CHUNK_ROWS = 256
+
+	def __init__(self, verbose = 0, source_cache = None):
+		super().__init__(verbose = verbose)
+		self._canvas = None
+		self._draw = None
+		self._tiles = { }
+		self._sources = source_cache if (source_cache is not None) else SourceCache()
+		self._fonts = { }
+		self._pages = [ ]
+
+	def _resample(self, infile, affine, cropbox, region = None):
+		source = self._sources.get(infile, region)
+		if source.region is not None:
+			affine = source.region.affine * affine
+		(a, b, c, d, e, f) = ImageTools.affine_coefficients(affine)
+
+		# Box-filter the source first when heavily downscaling; bilinear
+		# sampling alone would alias badly.
+		scale = math.sqrt(abs(a * e - b * d))
+		reduction = max(1, math.floor(1 / scale)) if scale > 0 else 1
+		(a, b, d, e) = (a * reduction, b * reduction, d * reduction, e * reduction)
+		pixels = source.pixels(reduction)
+
+		# Invert the 2x3 matrix to map destination pixels back into the source
+		det = a * e - b * d
+		(ia, ib, id, ie) = (e / det, -b / det, -d / det, a / det)
+
+		# Sample positions only depend on the absolute destination pixel, not on
+		# how the destination is split into crop boxes
+		(base_x, base_y) = (round(cropbox.base.x), round(cropbox.base.y))
+		width = round(cropbox.dimensions.x)
+		height = round(cropbox.dimensions.y)
+		dst_x = numpy.arange(base_x, base_x + width, dtype = numpy.float32) + numpy.float32(0.5 - c)
+		result = numpy.empty((height, width, 4), dtype = numpy.uint8)
+
+		# Work in chunks of rows so that the floating point temporaries stay
+		# small even for very large output images
+		for chunk_y in range(0, height, self._RESAMPLE_CHUNK_ROWS):
+			chunk_height = min(self._RESAMPLE_CHUNK_ROWS, height - chunk_y)
+			dst_y = numpy.arange(base_y + chunk_y, base_y + chunk_y + chunk_height, dtype = numpy.float32) + numpy.float32(0.5 - f)
+			(grid_x, grid_y) = numpy.meshgrid(dst_x, dst_y)
+
+			# Source coordinates, shifted by the one pixel of padding
+			src_x = (ia * grid_x) + (ib * grid_y) + 0.5
+			src_y = (id * grid_x) + (ie * grid_y) + 0.5
+			numpy.clip(src_x, 0, pixels.shape[1] - 1.001, out = src_x)
+			numpy.clip(src_y, 0, pixels.shape[0] - 1.001, out = src_y)
+
+			x0 = src_x.astype(numpy.intp)
+			y0 = src_y.astype(numpy.intp)
+			fx = (src_x - x0)[..., numpy.newaxis]
+			fy = (src_y - y0)[..., numpy.newaxis]
+			top = (pixels[y0, x0] * (1 - fx)) + (pixels[y0, x0 + 1] * fx)
+			bottom = (pixels[y0 + 1, x0] * (1 - fx)) + (pixels[y0 + 1, x0 + 1] * fx)
+			result[chunk_y : chunk_y + chunk_height] = numpy.rint((top * (1 - fy)) + (bottom * fy))
+		return Image.fromarray(result, "RGBA")
+
+	def _get_font(self, font_size):
+		if font_size not in self._fonts:
+			for font_name in [ "Arial.ttf", "DejaVuSans.ttf" ]:
+				try:
+					self._fonts[font_size] = ImageFont.truetype(font_name, font_size)
+					break
+				except OSError:
+					pass
+			else:
+				self._fonts[font_size] = ImageFont.load_default(font_size)
+		return self._fonts[font_size]
+
+	@staticmethod
+	def _color(color):
+		return None if ((color is None) or (color == "none")) else color
+
+	def new_canvas(self, dimensions, background):
+		self._canvas = Image.new("RGB", (round(dimensions.x), round(dimensions.y)), background)
+		self._draw = ImageDraw.Draw(self._canvas, "RGBA")
+
+	def open_image(self, filename):
+		self._canvas = Image.open(filename).convert("RGB")
+		self._draw = ImageDraw.Draw(self._canvas, "RGBA")
+
+	def open_region(self, filename, region):
+		source = self._sources.get(filename, region)
+		image = Image.fromarray(source.pixels()[1 : -1, 1 : -1], "RGBA")
+		if source.region != region:
+			# The shared decode is larger than the region, cut the region out
+			(x0, y0, x1, y1) = region.source_box
+			(scale, offset_x, offset_y) = (1, 0, 0) if (source.region is None) else (source.region.scale, source.region.crop[0], source.region.crop[1])
+			box = ((x0 * scale) - offset_x, (y0 * scale) - offset_y, (x1 * scale) - offset_x, (y1 * scale) - offset_y)
+			image = image.resize((region.crop[2], region.crop[3]), resample = Image.LANCZOS, box = box)
+		self._canvas = image.convert("RGB")
+		self._draw = ImageDraw.Draw(self._canvas, "RGBA")
+
+	def render_tile(self, name, infile, affine, dimensions, region = None):
+		self._tiles[name] = self._resample(infile, affine, geo.Box2d(base = geo.Vector2d(0, 0), dimensions = dimensions), region = region)
+
+	def place_tile(self, name, pos):
+		tile = self._tiles[name]
+		self._canvas.paste(tile, (round(pos.x), round(pos.y)), tile)
+
+	def blit(self, infile, affine, cropbox, region = None, y_offset = 0):
+		# The y_offset moves the result up on the canvas without changing how it
+		# is sampled, which is what BandedRenderer needs for its bands
+		image = self._resample(infile, affine, cropbox, region = region)
+		self._canvas.paste(image, (round(cropbox.base.x), round(cropbox.base.y) - y_offset), image)
+
+	def draw_line(self, p1, p2, stroke, stroke_width = 1):
+		self._draw.line([ (p1[0], p1[1]), (p2[0], p2[1]) ], fill = self._color(stroke), width = stroke_width)
+
+	def draw_lines(self, segments, stroke, stroke_width = 1):
+		fill = self._color(stroke)
+		for (x1, y1, x2, y2) in segments:
+			self._draw.line([ (x1, y1), (x2, y2) ], fill = fill, width = stroke_width)
+
+	def draw_rectangle(self, box, stroke, stroke_width = 1, fill = None):
+		upper = box.base + box.dimensions
+		self._draw.rectangle([ (box.base.x, box.base.y), (upper.x, upper.y) ], outline = self._color(stroke), fill = self._color(fill), width = stroke_width)
+
+	def draw_circle(self, center, radius, stroke, fill, stroke_width = 1):
+		self._draw.ellipse([ (center[0] - radius, center[1] - radius), (center[0] + radius, center[1] + radius) ], outline = self._color(stroke), fill = self._color(fill), width = stroke_width)
+
+	def draw_text(self, pos, text, color = "red", font_size = 12):
+		self._draw.text((pos.x, pos.y), text, fill = self._color(color), font = self._get_font(font_size), anchor = "ls")
+
+	def finish(self):
+		"""Returns the rendered canvas instead of writing it to a file."""
+		canvas = self._canvas
+		self._canvas = None
+		self._draw = None
+		return canvas
+
+	def write(self, filename):
+		self.finish().save(filename)
+
+	def new_document(self):
+		self._pages = [ ]
+		self._canvas = None
+		self._draw = None
+
+	def new_page(self, dimensions, background):
+		if self._canvas is not None:
+			self._pages.append(self.finish())
+		self.new_canvas(dimensions, background)
+
+	def write_document(self, filename, resolution = None):
+		if self._canvas is not None:
+			self._pages.append(self.finish())
+		(pages, self._pages) = (self._pages, [ ])
+		options = { }
+		if resolution is not None:
+			# PDF takes "resolution", all other formats take "dpi"
+			options = { "resolution": resolution, "dpi": (resolution, resolution) }
+		if "%" in filename:
+			for (page_no, page) in enumerate(pages, 1):
+				page.save(filename % (page_no), **options)
+		elif len(pages) == 1:
+			pages[0].save(filename, **options)
+		else:
+			pages[0].save(filename, save_all = True, append_images = pages[1 : ], **options)
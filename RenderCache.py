@@ -0,0 +1,148 @@
+#	gbpig - German Biometric Passport Image Generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of gbpig.
+#
+#	gbpig is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	gbpig is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with gbpig; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+import os
+import json
+import shutil
+import hashlib
+
+class RenderCache():
+	"""Stores rendered sheets under a key that covers everything the output
+	depends on: the source image, the POIs, the definitions, the layout
+	options and the code that renders. Any change to one of the modules in
+	_CODE_FILES therefore invalidates all entries by itself. The versions of
+	ImageMagick and Pillow are not part of the key; clear the cache after
+	upgrading them. _VERSION only needs to be bumped when the way the cache
+	stores entries changes."""
+	_VERSION = 1
+	_CODE_FILES = [ "PassportGenerator.py", "LayoutProfile.py", "Renderer.py", "PillowRenderer.py", "BandedRenderer.py", "StreamWriter.py", "Tools.py" ]
+	_code_version = None
+
+	def __init__(self, cache_dir, max_size, verbose = 0):
+		self._cache_dir = cache_dir
+		self._max_size = max_size
+		self._verbose = verbose
+		os.makedirs(self._cache_dir, exist_ok = True)
+
+	@classmethod
+	def default_directory(cls):
+		cache_home = os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+		return os.path.join(cache_home, "gbpig")
+
+	@classmethod
+	def hash_file(cls, filename):
+		hashval = hashlib.sha256()
+		with open(filename, "rb") as f:
+			while True:
+				chunk = f.read(1024 * 1024)
+				if len(chunk) == 0:
+					break
+				hashval.update(chunk)
+		return hashval.hexdigest()
+
+	@classmethod
+	def code_version(cls):
+		"""Returns a hash over the sources of all modules that determine the
+		rendered output."""
+		if cls._code_version is None:
+			hashval = hashlib.sha256()
+			base_dir = os.path.dirname(os.path.abspath(__file__))
+			for filename in cls._CODE_FILES:
+				with open(os.path.join(base_dir, filename), "rb") as f:
+					hashval.update(filename.encode() + b"\0" + f.read())
+			cls._code_version = hashval.hexdigest()
+		return cls._code_version
+
+	@classmethod
+	def compute_key(cls, source_filename, pois, definitions, layout):
+		key_data = {
+			"version":		cls._VERSION,
+			"code":			cls.code_version(),
+			"source":		cls.hash_file(source_filename),
+			"pois":			pois,
+			"definitions":	definitions,
+			"layout":		layout,
+		}
+		return hashlib.sha256(json.dumps(key_data, sort_keys = True).encode()).hexdigest()
+
+	def _entry_filename(self, key, suffix):
+		return os.path.join(self._cache_dir, key[:2], key + suffix)
+
+	def fetch(self, key, output_filename):
+		"""Copies the cached rendering to output_filename and returns True on a
+		cache hit, returns False otherwise."""
+		suffix = os.path.splitext(output_filename)[1].lower()
+		entry_filename = self._entry_filename(key, suffix)
+		try:
+			shutil.copyfile(entry_filename, output_filename)
+		except FileNotFoundError:
+			if self._verbose >= 2:
+				print("Render cache miss: %s" % (key))
+			return False
+
+		# The modification time records the last use for LRU eviction
+		os.utime(entry_filename)
+		if self._verbose >= 2:
+			print("Render cache hit: %s" % (key))
+		return True
+
+	def store(self, key, rendered_filename):
+		import tempfile
+		suffix = os.path.splitext(rendered_filename)[1].lower()
+		entry_filename = self._entry_filename(key, suffix)
+		os.makedirs(os.path.dirname(entry_filename), exist_ok = True)
+		(fd, tmp_filename) = tempfile.mkstemp(dir = os.path.dirname(entry_filename), prefix = ".tmp_")
+		os.close(fd)
+		try:
+			shutil.copyfile(rendered_filename, tmp_filename)
+			os.replace(tmp_filename, entry_filename)
+		except:
+			os.unlink(tmp_filename)
+			raise
+		self._evict()
+
+	def _evict(self):
+		entries = [ ]
+		total_size = 0
+		for (dirname, subdirs, filenames) in os.walk(self._cache_dir):
+			for filename in filenames:
+				if filename.startswith(".tmp_"):
+					continue
+				full_filename = os.path.join(dirname, filename)
+				try:
+					stat = os.stat(full_filename)
+				except FileNotFoundError:
+					continue
+				entries.append((stat.st_mtime, stat.st_size, full_filename))
+				total_size += stat.st_size
+
+		entries.sort()
+		for (mtime, size, full_filename) in entries:
+			if total_size <= self._max_size:
+				break
+			try:
+				os.unlink(full_filename)
+				if self._verbose >= 2:
+					print("Render cache evicted: %s" % (full_filename))
+			except FileNotFoundError:
+				pass
+			total_size -= size
@@ -0,0 +1,304 @@
+#	gbpig - German Biometric Passport Image Generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of gbpig.
+#
+#	gbpig is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	gbpig is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with gbpig; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+import os
+import copy
+import json
+import time
+import socket
+import shutil
+import tempfile
+import threading
+import http.client
+import http.server
+import socketserver
+from PassportGenerator import PassportGenerator
+
+class ServiceBusyException(Exception): pass
+class InvalidRequestException(Exception): pass
+
+class RenderServiceException(Exception):
+	"""Raised by the client when the service rejects a request."""
+	def __init__(self, status, message):
+		super().__init__("Render service returned HTTP %d: %s" % (status, message))
+		self.status = status
+		self.message = message
+
+class RenderService():
+	_CONTENT_TYPES = {
+		"jpg":		"image/jpeg",
+		"jpeg":		"image/jpeg",
+		"png":		"image/png",
+		"tif":		"image/tiff",
+		"tiff":		"image/tiff",
+		"pdf":		"application/pdf",
+	}
+
+	def __init__(self, default_args, concurrency = 2, queue_size = 8, output_dir = None):
+		self._default_args = default_args
+		self._output_dir = os.path.realpath(output_dir) if (output_dir is not None) else None
+		self._concurrency = concurrency
+		self._queue_size = queue_size
+		self._render_slots = threading.Semaphore(concurrency)
+		self._admission_slots = threading.Semaphore(concurrency + queue_size)
+		self._stats_lock = threading.Lock()
+		self._stats = {
+			"pending":		0,
+			"completed":	0,
+			"failed":		0,
+			"rejected":		0,
+		}
+		if default_args.backend == "pillow":
+			from PillowRenderer import SourceCache
+			self._source_cache = SourceCache(capacity = concurrency + queue_size)
+		else:
+			self._source_cache = None
+
+	@property
+	def stats(self):
+		with self._stats_lock:
+			stats = dict(self._stats)
+		stats["concurrency"] = self._concurrency
+		stats["queue_size"] = self._queue_size
+		return stats
+
+	def _count(self, key, delta = 1):
+		with self._stats_lock:
+			self._stats[key] += delta
+
+	def _create_args(self, options, output_filename):
+		try:
+			options = PassportGenerator.coerce_options(options, excluded = [ "cache_dir", "save_profile", "profile_dir" ])
+		except ValueError as e:
+			raise InvalidRequestException(str(e))
+		args = copy.copy(self._default_args)
+		for (key, value) in options.items():
+			setattr(args, key, value)
+		if (args.resolution <= 0) or (args.canvas_width <= 0) or (args.canvas_height <= 0) or (args.border_size < 0) or (args.line_size < 0) or (args.band_height < 0):
+			raise InvalidRequestException("Resolution and canvas dimensions need to be positive, sizes must not be negative.")
+		args.json_input_filename = None
+		args.image_output_filename = output_filename
+		return args
+
+	def _resolve_output_filename(self, output_filename):
+		if self._output_dir is None:
+			raise InvalidRequestException("Writing output files is disabled, the service needs to be started with an output directory.")
+		if not isinstance(output_filename, str):
+			raise InvalidRequestException("Output filename needs to be a string.")
+		resolved = os.path.realpath(os.path.join(self._output_dir, output_filename))
+		if (resolved == self._output_dir) or (os.path.commonpath([ resolved, self._output_dir ]) != self._output_dir):
+			raise InvalidRequestException("Output filename escapes the output directory: %s" % (output_filename))
+		return resolved
+
+	def render(self, job_data, options = None, output_format = "jpg", output_filename = None):
+		"""Renders a job and either writes it to output_filename, which is
+		relative to the output directory of the service, or returns the rendered
+		image as bytes. Also returns a dictionary of timings."""
+		if output_format not in self._CONTENT_TYPES:
+			raise InvalidRequestException("Unsupported output format: %s" % (output_format))
+		if output_filename is not None:
+			output_filename = self._resolve_output_filename(output_filename)
+		if (not isinstance(job_data, dict)) or ("image" not in job_data) or ("pois" not in job_data):
+			raise InvalidRequestException("Job needs 'image' and 'pois'.")
+		if not self._admission_slots.acquire(blocking = False):
+			self._count("rejected")
+			raise ServiceBusyException("Render queue is full.")
+
+		try:
+			self._count("pending")
+			t_received = time.perf_counter()
+			with self._render_slots:
+				t_started = time.perf_counter()
+				with tempfile.TemporaryDirectory(prefix = "gbpig_") as tmpdir:
+					render_filename = os.path.join(tmpdir, "output." + output_format)
+					args = self._create_args(options or { }, render_filename)
+					try:
+						PassportGenerator(args, source_cache = self._source_cache, job_data = job_data).run()
+					except:
+						self._count("failed")
+						raise
+					t_rendered = time.perf_counter()
+					if output_filename is None:
+						with open(render_filename, "rb") as f:
+							result = f.read()
+					else:
+						os.makedirs(os.path.dirname(output_filename), exist_ok = True)
+						shutil.move(render_filename, output_filename)
+						result = output_filename
+			t_finished = time.perf_counter()
+			self._count("completed")
+		finally:
+			self._count("pending", -1)
+			self._admission_slots.release()
+
+		timing = {
+			"queue":	t_started - t_received,
+			"render":	t_rendered - t_started,
+			"total":	t_finished - t_received,
+		}
+		return (result, timing)
+
+	def content_type(self, output_format):
+		return self._CONTENT_TYPES[output_format]
+
+class RenderRequestHandler(http.server.BaseHTTPRequestHandler):
+	def log_message(self, format, *args):
+		if self.server.verbose >= 1:
+			print(format % args)
+
+	def _send_json(self, status, data, headers = None):
+		payload = json.dumps(data, sort_keys = True).encode()
+		self.send_response(status)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(payload)))
+		for (key, value) in (headers or { }).items():
+			self.send_header(key, value)
+		self.end_headers()
+		self.wfile.write(payload)
+
+	def do_GET(self):
+		if self.path == "/status":
+			self._send_json(200, self.server.service.stats)
+		else:
+			self._send_json(404, { "error": "Not found: %s" % (self.path) })
+
+	def do_POST(self):
+		if self.path != "/render":
+			self._send_json(404, { "error": "Not found: %s" % (self.path) })
+			return
+
+		try:
+			length = int(self.headers.get("Content-Length", 0))
+			request = json.loads(self.rfile.read(length))
+			output_format = request.get("format", "jpg")
+			(result, timing) = self.server.service.render(request.get("job"), options = request.get("options"), output_format = output_format, output_filename = request.get("output_filename"))
+		except (InvalidRequestException, ValueError, AttributeError) as e:
+			self._send_json(400, { "error": str(e) })
+			return
+		except ServiceBusyException as e:
+			self._send_json(503, { "error": str(e) }, headers = { "Retry-After": "1" })
+			return
+		except Exception as e:
+			self._send_json(500, { "error": "%s: %s" % (e.__class__.__name__, str(e)) })
+			return
+
+		timing_header = ";".join("%s=%.6f" % (key, value) for (key, value) in sorted(timing.items()))
+		if isinstance(result, bytes):
+			self.send_response(200)
+			self.send_header("Content-Type", self.server.service.content_type(output_format))
+			self.send_header("Content-Length", str(len(result)))
+			self.send_header("X-Render-Timing", timing_header)
+			self.end_headers()
+			self.wfile.write(result)
+		else:
+			self._send_json(200, { "filename": result, "timing": timing }, headers = { "X-Render-Timing": timing_header })
+
+class RenderHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+	daemon_threads = True
+
+	def __init__(self, address, service, verbose = 0):
+		self.service = service
+		self.verbose = verbose
+		super().__init__(address, RenderRequestHandler)
+
+class RenderUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+	daemon_threads = True
+
+	def __init__(self, socket_filename, service, verbose = 0):
+		self.service = service
+		self.verbose = verbose
+		if os.path.exists(socket_filename):
+			os.unlink(socket_filename)
+		super().__init__(socket_filename, RenderRequestHandler)
+
+	def get_request(self):
+		(request, client_address) = super().get_request()
+		# BaseHTTPRequestHandler expects a (host, port) tuple
+		return (request, ("local", 0))
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+	def __init__(self, socket_filename, timeout = None):
+		super().__init__("localhost", timeout = timeout)
+		self._socket_filename = socket_filename
+
+	def connect(self):
+		self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		if self.timeout is not None:
+			self.sock.settimeout(self.timeout)
+		self.sock.connect(self._socket_filename)
+
+class RenderClient():
+	def __init__(self, socket_filename = None, host = "127.0.0.1", port = 8765, timeout = 60):
+		self._socket_filename = socket_filename
+		self._host = host
+		self._port = port
+		self._timeout = timeout
+
+	def _connect(self):
+		if self._socket_filename is not None:
+			return UnixHTTPConnection(self._socket_filename, timeout = self._timeout)
+		else:
+			return http.client.HTTPConnection(self._host, self._port, timeout = self._timeout)
+
+	@staticmethod
+	def _parse_timing(header):
+		if header is None:
+			return None
+		return { key: float(value) for (key, value) in (item.split("=") for item in header.split(";")) }
+
+	def _request(self, method, path, body = None):
+		conn = self._connect()
+		try:
+			conn.request(method, path, body = body, headers = { "Content-Type": "application/json" } if (body is not None) else { })
+			response = conn.getresponse()
+			data = response.read()
+			if response.status != 200:
+				try:
+					message = json.loads(data)["error"]
+				except (ValueError, KeyError):
+					message = data.decode(errors = "replace")
+				raise RenderServiceException(response.status, message)
+			return (response, data)
+		finally:
+			conn.close()
+
+	def status(self):
+		(response, data) = self._request("GET", "/status")
+		return json.loads(data)
+
+	def render(self, job_data, options = None, output_format = "jpg", output_filename = None):
+		"""Returns a tuple of the rendered image (bytes, or the full output
+		filename if one was given) and the timing reported by the service. An
+		output filename is relative to the output directory of the service."""
+		request = {
+			"job":		job_data,
+			"options":	options or { },
+			"format":	output_format,
+		}
+		if output_filename is not None:
+			request["output_filename"] = output_filename
+		(response, data) = self._request("POST", "/render", body = json.dumps(request).encode())
+		timing = self._parse_timing(response.getheader("X-Render-Timing"))
+		if output_filename is None:
+			return (data, timing)
+		else:
+			return (json.loads(data)["filename"], timing)
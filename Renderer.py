@@ -0,0 +1,335 @@
+#	gbpig - German Biometric Passport Image Generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of gbpig.
+#
+#	gbpig is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	gbpig is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with gbpig; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+import os
+import math
+import shutil
+import tempfile
+import subprocess
+from Tools import ImageTools
+import geo
+
+class SourceRegion():
+	"""Describes which part of a source image needs to be decoded and at which
+	scale. Coordinates of the crop are given in the scaled source image."""
+	def __init__(self, image_size, scale, crop):
+		self._image_size = image_size
+		self._scaled_size = (max(1, round(image_size[0] * scale)), max(1, round(image_size[1] * scale)))
+		self._scale = self._scaled_size[0] / image_size[0]
+		self._crop = crop
+
+	@classmethod
+	def from_source_box(cls, image_size, scale, source_min, source_max, margin = 16):
+		"""Creates a region that covers the source pixels in the rectangle
+		between source_min and source_max (given in unscaled source pixels)
+		plus a margin (given in scaled pixels) that accounts for the support of
+		the resampling filter."""
+		region = cls(image_size, scale, None)
+		(scaled_width, scaled_height) = region.scaled_size
+		x0 = min(max(0, math.floor(source_min[0] * region.scale) - margin), scaled_width - 1)
+		y0 = min(max(0, math.floor(source_min[1] * region.scale) - margin), scaled_height - 1)
+		x1 = max(min(scaled_width, math.ceil(source_max[0] * region.scale) + margin), x0 + 1)
+		y1 = max(min(scaled_height, math.ceil(source_max[1] * region.scale) + margin), y0 + 1)
+		region._crop = (x0, y0, x1 - x0, y1 - y0)
+		return region
+
+	@property
+	def image_size(self):
+		return self._image_size
+
+	@property
+	def scaled_size(self):
+		return self._scaled_size
+
+	@property
+	def scale(self):
+		return self._scale
+
+	@property
+	def crop(self):
+		return self._crop
+
+	@property
+	def affine(self):
+		"""Transformation from the decoded region into original source image
+		coordinates."""
+		return geo.TransformationMatrix.translate(geo.Vector2d(self._crop[0], self._crop[1])) * geo.TransformationMatrix.scale(1 / self._scale)
+
+	@property
+	def source_box(self):
+		"""The covered rectangle in unscaled source pixels as (x0, y0, x1,
+		y1)."""
+		(x, y, width, height) = self._crop
+		return (x / self._scale, y / self._scale, (x + width) / self._scale, (y + height) / self._scale)
+
+	def covers(self, other):
+		"""Returns if a decode of this region is good enough to render what
+		the other region is needed for, i.e., if it has at least the same
+		scale and contains the other region."""
+		if (other is None) or (other.image_size != self.image_size) or (other.scale > self.scale):
+			return False
+		(own, others) = (self.source_box, other.source_box)
+		epsilon = 1e-6
+		return (own[0] <= others[0] + epsilon) and (own[1] <= others[1] + epsilon) and (own[2] >= others[2] - epsilon) and (own[3] >= others[3] - epsilon)
+
+	def union(self, other):
+		"""Returns the smallest region that covers this and the other
+		region."""
+		(own, others) = (self.source_box, other.source_box)
+		return SourceRegion.from_source_box(self.image_size, max(self.scale, other.scale), (min(own[0], others[0]), min(own[1], others[1])), (max(own[2], others[2]), max(own[3], others[3])), margin = 0)
+
+	@property
+	def inverse_affine(self):
+		"""Transformation from original source image coordinates into the
+		decoded region."""
+		return geo.TransformationMatrix.scale(self._scale) * geo.TransformationMatrix.translate(geo.Vector2d(-self._crop[0], -self._crop[1]))
+
+	def __eq__(self, other):
+		if not isinstance(other, SourceRegion):
+			return NotImplemented
+		return (self.image_size, self.scaled_size, self.crop) == (other.image_size, other.scaled_size, other.crop)
+
+	def __hash__(self):
+		return hash((self.image_size, self.scaled_size, self.crop))
+
+	def __str__(self):
+		return "SourceRegion<%d x %d at %.3f: %d x %d + %d + %d>" % (self.image_size[0], self.image_size[1], self.scale, self.crop[2], self.crop[3], self.crop[0], self.crop[1])
+
+class Renderer():
+	def __init__(self, verbose = 0):
+		self._verbose = verbose
+
+	def new_canvas(self, dimensions, background):
+		raise NotImplementedError(self.__class__.__name__)
+
+	def open_image(self, filename):
+		raise NotImplementedError(self.__class__.__name__)
+
+	def open_region(self, filename, region):
+		raise NotImplementedError(self.__class__.__name__)
+
+	def render_tile(self, name, infile, affine, dimensions, region = None):
+		raise NotImplementedError(self.__class__.__name__)
+
+	def place_tile(self, name, pos):
+		raise NotImplementedError(self.__class__.__name__)
+
+	def blit(self, infile, affine, cropbox, region = None):
+		raise NotImplementedError(self.__class__.__name__)
+
+	def draw_line(self, p1, p2, stroke, stroke_width = 1):
+		raise NotImplementedError(self.__class__.__name__)
+
+	def draw_relline(self, p1, rel, stroke, stroke_width = 1):
+		self.draw_line(p1, p1 + rel, stroke = stroke, stroke_width = stroke_width)
+
+	def draw_lines(self, segments, stroke, stroke_width = 1):
+		"""Draws many lines of the same style at once. Segments are given as
+		(x1, y1, x2, y2) tuples."""
+		for (x1, y1, x2, y2) in segments:
+			self.draw_line(geo.Vector2d(x1, y1), geo.Vector2d(x2, y2), stroke = stroke, stroke_width = stroke_width)
+
+	def draw_arrow(self, p1, p2, stroke, stroke_width = 1, tip_size = 8):
+		direct = (p1 - p2).norm()
+		perp = (p1 - p2).perpendicular().norm()
+		self.draw_line(p1 = p1, p2 = p2, stroke = stroke, stroke_width = stroke_width)
+		self.draw_relline(p1 = p1, rel = perp * tip_size - direct * tip_size, stroke = stroke, stroke_width = stroke_width)
+		self.draw_relline(p1 = p1, rel = perp * -tip_size - direct * tip_size, stroke = stroke, stroke_width = stroke_width)
+		self.draw_relline(p1 = p2, rel = perp * tip_size - direct * -tip_size, stroke = stroke, stroke_width = stroke_width)
+		self.draw_relline(p1 = p2, rel = perp * -tip_size - direct * -tip_size, stroke = stroke, stroke_width = stroke_width)
+
+	def draw_rectangle(self, box, stroke, stroke_width = 1, fill = None):
+		raise NotImplementedError(self.__class__.__name__)
+
+	def draw_circle(self, center, radius, stroke, fill, stroke_width = 1):
+		raise NotImplementedError(self.__class__.__name__)
+
+	def draw_text(self, pos, text, color = "red", font_size = 12):
+		raise NotImplementedError(self.__class__.__name__)
+
+	def write(self, filename):
+		raise NotImplementedError(self.__class__.__name__)
+
+	def new_document(self):
+		"""Starts a document of several pages. Tiles that are rendered after
+		this call can be placed on every page of the document."""
+		raise NotImplementedError(self.__class__.__name__)
+
+	def new_page(self, dimensions, background):
+		raise NotImplementedError(self.__class__.__name__)
+
+	def write_document(self, filename, resolution = None):
+		"""Writes all pages of the document. If the filename contains a
+		printf-style placeholder (e.g., "sheet_%02d.png"), every page is
+		written to its own file, numbered from 1. Otherwise all pages go into
+		one file, which requires a multi-page format such as PDF or TIFF."""
+		raise NotImplementedError(self.__class__.__name__)
+
+class ImageMagickRenderer(Renderer):
+	"""Builds a single convert command line. Draw primitives are not put on
+	the command line but collected into MVG files, which ImageMagick renders
+	in one pass each and composites onto the canvas. This keeps the command
+	line short no matter how many primitives a sheet has."""
+	def __init__(self, verbose = 0):
+		super().__init__(verbose = verbose)
+		self._cmdline = None
+		self._page_open = False
+		self._dimensions = None
+		self._sources = { }
+		self._mvg = [ ]
+		self._mvg_context = { }
+		self._temp_dir = None
+
+	def _execute(self, cmd):
+		if self._verbose >= 3:
+			print(cmd)
+		try:
+			subprocess.check_call(cmd)
+		finally:
+			self._reset()
+
+	def _reset(self):
+		self._cmdline = None
+		self._page_open = False
+		self._sources = { }
+		self._mvg = [ ]
+		self._mvg_context = { }
+		if self._temp_dir is not None:
+			shutil.rmtree(self._temp_dir, ignore_errors = True)
+			self._temp_dir = None
+
+	def _start(self, cmdline, dimensions):
+		self._reset()
+		self._cmdline = cmdline
+		self._dimensions = dimensions
+
+	def _mvg_set(self, keyword, value):
+		if self._mvg_context.get(keyword) != value:
+			self._mvg.append("%s %s" % (keyword, value))
+			self._mvg_context[keyword] = value
+
+	def _mvg_style(self, stroke, stroke_width, fill):
+		self._mvg_set("stroke", "\"%s\"" % (stroke or "none"))
+		self._mvg_set("stroke-width", str(stroke_width))
+		self._mvg_set("fill", "\"%s\"" % (fill or "none"))
+
+	def _flush_mvg(self):
+		"""Emits the draw primitives collected so far. Needs to be called
+		before anything that composites onto the canvas, so that the order of
+		operations is retained."""
+		if len(self._mvg) == 0:
+			return
+		if self._temp_dir is None:
+			self._temp_dir = tempfile.mkdtemp(prefix = "gbpig_")
+		mvg_filename = os.path.join(self._temp_dir, "draw%d.mvg" % (len(os.listdir(self._temp_dir))))
+		with open(mvg_filename, "w") as f:
+			print("viewbox 0 0 %.0f %.0f" % (self._dimensions.x, self._dimensions.y), file = f)
+			for primitive in self._mvg:
+				print(primitive, file = f)
+		self._cmdline += ImageTools.imagemagick_overlay_mvg(mvg_filename)
+		self._mvg = [ ]
+		self._mvg_context = { }
+
+	def _get_source(self, infile, region):
+		# Decode every source only once, even if it is blitted many times
+		key = (infile, region)
+		if key not in self._sources:
+			name = "source%d" % (len(self._sources))
+			self._cmdline += ImageTools.imagemagick_store_source(name, infile, region = region)
+			self._sources[key] = [ "mpr:%s" % (name) ]
+		return self._sources[key]
+
+	def new_canvas(self, dimensions, background):
+		self._start([ "convert", "-size", "%.0fx%.0f" % (dimensions.x, dimensions.y), "xc:%s" % (background) ], dimensions)
+
+	def open_image(self, filename):
+		info = ImageTools.probe_image(filename)
+		self._start([ "convert", filename ], geo.Vector2d(info.width, info.height))
+
+	def open_region(self, filename, region):
+		self._start([ "convert" ] + ImageTools.imagemagick_read_region(filename, region), geo.Vector2d(region.crop[2], region.crop[3]))
+
+	def render_tile(self, name, infile, affine, dimensions, region = None):
+		self._flush_mvg()
+		if region is not None:
+			affine = region.affine * affine
+		self._cmdline += ImageTools.imagemagick_render_tile(name, infile, affine, dimensions, region = region)
+
+	def place_tile(self, name, pos):
+		self._flush_mvg()
+		self._cmdline += ImageTools.imagemagick_place_tile(name, pos)
+
+	def blit(self, infile, affine, cropbox, region = None):
+		self._flush_mvg()
+		if region is not None:
+			affine = region.affine * affine
+		self._cmdline += ImageTools.imagemagick_blit(infile, affine, cropbox, region = region, source = self._get_source(infile, region))
+
+	def draw_line(self, p1, p2, stroke, stroke_width = 1):
+		self._mvg_style(stroke, stroke_width, None)
+		self._mvg.append("line %f,%f %f,%f" % (p1[0], p1[1], p2[0], p2[1]))
+
+	def draw_lines(self, segments, stroke, stroke_width = 1):
+		self._mvg_style(stroke, stroke_width, None)
+		self._mvg += [ "line %f,%f %f,%f" % segment for segment in segments ]
+
+	def draw_rectangle(self, box, stroke, stroke_width = 1, fill = None):
+		upper = box.base + box.dimensions
+		self._mvg_style(stroke, stroke_width, fill)
+		self._mvg.append("rectangle %f,%f %f,%f" % (box.base.x, box.base.y, upper.x, upper.y))
+
+	def draw_circle(self, center, radius, stroke, fill, stroke_width = 1):
+		self._mvg_style(stroke, stroke_width, fill)
+		self._mvg.append("circle %f,%f %f,%f" % (center[0], center[1], center[0] + radius, center[1]))
+
+	def draw_text(self, pos, text, color = "red", font_size = 12):
+		self._mvg_style(None, 1, color)
+		self._mvg_set("font", "'Arial'")
+		self._mvg_set("font-size", str(font_size))
+		self._mvg.append("text %f,%f %s" % (pos.x, pos.y, ImageTools.mvg_text(text)))
+
+	def write(self, filename):
+		self._flush_mvg()
+		self._execute(self._cmdline + [ filename ])
+
+	def new_document(self):
+		# All pages are built in a single invocation so that tiles stored in
+		# mpr: registers are shared between the pages
+		self._start([ "convert" ], None)
+
+	def new_page(self, dimensions, background):
+		if self._page_open:
+			self._flush_mvg()
+			self._cmdline += [ ")" ]
+		self._cmdline += [ "(", "-size", "%.0fx%.0f" % (dimensions.x, dimensions.y), "xc:%s" % (background) ]
+		self._dimensions = dimensions
+		self._page_open = True
+
+	def write_document(self, filename, resolution = None):
+		if self._page_open:
+			self._flush_mvg()
+			self._cmdline += [ ")" ]
+		if resolution is not None:
+			self._cmdline += [ "-units", "PixelsPerInch", "-density", "%d" % (resolution) ]
+		if "%" in filename:
+			self._cmdline += [ "+adjoin", "-scene", "1" ]
+		self._execute(self._cmdline + [ filename ])
@@ -0,0 +1,85 @@
+#	gbpig - German Biometric Passport Image Generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of gbpig.
+#
+#	gbpig is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	gbpig is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with gbpig; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+import sys
+import time
+import resource
+import contextlib
+import collections
+
+class StageTimer():
+	"""Records wall time, CPU time and peak resident set size of consecutive
+	stages of the render pipeline. CPU time includes child processes (i.e.,
+	ImageMagick) that have finished during the stage. Both CPU time and RSS are
+	process-wide, so when several renders run in threads of the same process
+	only the wall time is meaningful per render."""
+	_Stage = collections.namedtuple("Stage", [ "name", "wall", "cpu", "peak_rss" ])
+
+	def __init__(self):
+		self._stages = [ ]
+
+	@property
+	def stages(self):
+		return iter(self._stages)
+
+	@property
+	def wall(self):
+		return sum(stage.wall for stage in self._stages)
+
+	@property
+	def cpu(self):
+		return sum(stage.cpu for stage in self._stages)
+
+	@property
+	def peak_rss(self):
+		return max((stage.peak_rss for stage in self._stages), default = 0)
+
+	@staticmethod
+	def _usage():
+		own = resource.getrusage(resource.RUSAGE_SELF)
+		children = resource.getrusage(resource.RUSAGE_CHILDREN)
+		cpu = own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+		peak_rss = max(own.ru_maxrss, children.ru_maxrss)
+		if sys.platform != "darwin":
+			# Linux reports kiB, macOS reports bytes
+			peak_rss *= 1024
+		return (cpu, peak_rss)
+
+	@contextlib.contextmanager
+	def stage(self, name):
+		(cpu_start, _) = self._usage()
+		t0 = time.perf_counter()
+		try:
+			yield
+		finally:
+			wall = time.perf_counter() - t0
+			(cpu_end, peak_rss) = self._usage()
+			self._stages.append(self._Stage(name = name, wall = wall, cpu = cpu_end - cpu_start, peak_rss = peak_rss))
+
+	def to_dict(self):
+		return { stage.name: { "wall": stage.wall, "cpu": stage.cpu, "peak_rss": stage.peak_rss } for stage in self._stages }
+
+	def dump(self):
+		print("%-16s %10s %10s %10s" % ("Stage", "Wall", "CPU", "Peak RSS"))
+		for stage in self._stages:
+			print("%-16s %7.1f ms %7.1f ms %6.1f MiB" % (stage.name, stage.wall * 1000, stage.cpu * 1000, stage.peak_rss / 1024 / 1024))
+		print("%-16s %7.1f ms %7.1f ms %6.1f MiB" % ("total", self.wall * 1000, self.cpu * 1000, self.peak_rss / 1024 / 1024))
@@ -0,0 +1,212 @@
+#	gbpig - German Biometric Passport Image Generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of gbpig.
+#
+#	gbpig is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	gbpig is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with gbpig; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+import os
+import zlib
+import struct
+import numpy
+
+class StreamWriter():
+	"""Writes an RGB image band by band from top to bottom, so that the whole
+	image never has to be held in memory. Bands are given as NumPy arrays of
+	shape (rows, width, 3) and dtype uint8."""
+	def __init__(self, filename, width, height, resolution = None):
+		self._f = open(filename, "wb")
+		self._width = width
+		self._height = height
+		self._resolution = resolution
+		self._rows_written = 0
+
+	@classmethod
+	def _writer_class(cls, filename):
+		ext = os.path.splitext(filename)[1].lower()
+		if ext == ".png":
+			return PNGStreamWriter
+		elif ext in [ ".tif", ".tiff" ]:
+			return TIFFStreamWriter
+		else:
+			return None
+
+	@classmethod
+	def supports(cls, filename):
+		return cls._writer_class(filename) is not None
+
+	@classmethod
+	def open(cls, filename, width, height, resolution = None):
+		writer_class = cls._writer_class(filename)
+		if writer_class is None:
+			raise ValueError("Streaming output is only supported for PNG and TIFF, not '%s'." % (os.path.splitext(filename)[1]))
+		return writer_class(filename, width, height, resolution = resolution)
+
+	@staticmethod
+	def _horizontal_difference(band):
+		"""Replaces every sample by its difference to the same sample of the
+		pixel to the left. This is both PNG's 'Sub' filter and TIFF's
+		horizontal predictor, and makes photos compress much better."""
+		rows = band.reshape(band.shape[0], -1)
+		differences = rows.copy()
+		differences[:, 3 : ] -= rows[:, : -3]
+		return differences
+
+	def write_band(self, band):
+		if band.shape[1 : ] != (self._width, 3):
+			raise ValueError("Band of shape %s does not match an image width of %d pixels." % (str(band.shape), self._width))
+		if self._rows_written + band.shape[0] > self._height:
+			raise ValueError("Band exceeds the image height of %d pixels." % (self._height))
+		self._write_band(band)
+		self._rows_written += band.shape[0]
+
+	def _write_band(self, band):
+		raise NotImplementedError(self.__class__.__name__)
+
+	def _finish(self):
+		raise NotImplementedError(self.__class__.__name__)
+
+	def close(self):
+		if self._f is None:
+			return
+		try:
+			if self._rows_written != self._height:
+				raise ValueError("Only %d of %d rows were written." % (self._rows_written, self._height))
+			self._finish()
+		finally:
+			self._f.close()
+			self._f = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+class PNGStreamWriter(StreamWriter):
+	def __init__(self, filename, width, height, resolution = None):
+		super().__init__(filename, width, height, resolution = resolution)
+		self._compressor = zlib.compressobj(6)
+		self._f.write(b"\x89PNG\r\n\x1a\n")
+		self._write_chunk(b"IHDR", struct.pack(">LLBBBBB", width, height, 8, 2, 0, 0, 0))
+		if resolution is not None:
+			pixels_per_meter = round(resolution / 0.0254)
+			self._write_chunk(b"pHYs", struct.pack(">LLB", pixels_per_meter, pixels_per_meter, 1))
+
+	def _write_chunk(self, chunk_type, data):
+		self._f.write(struct.pack(">L", len(data)))
+		self._f.write(chunk_type)
+		self._f.write(data)
+		self._f.write(struct.pack(">L", zlib.crc32(data, zlib.crc32(chunk_type))))
+
+	def _write_band(self, band):
+		# Every row is prefixed with its filter type, 1 being 'Sub'
+		rows = numpy.empty((band.shape[0], 1 + (3 * self._width)), dtype = numpy.uint8)
+		rows[:, 0] = 1
+		rows[:, 1 : ] = self._horizontal_difference(band)
+		data = self._compressor.compress(rows.tobytes())
+		if len(data) > 0:
+			self._write_chunk(b"IDAT", data)
+
+	def _finish(self):
+		self._write_chunk(b"IDAT", self._compressor.flush())
+		self._write_chunk(b"IEND", b"")
+
+class TIFFStreamWriter(StreamWriter):
+	"""Writes a little-endian baseline TIFF with one Deflate-compressed strip
+	per band. All bands except the last one need to have the same height.
+	The strips are written first and the directory last, so the file needs to
+	be seekable to patch the directory offset in the header."""
+	_TYPE_SHORT = 3
+	_TYPE_LONG = 4
+	_TYPE_RATIONAL = 5
+
+	def __init__(self, filename, width, height, resolution = None):
+		super().__init__(filename, width, height, resolution = resolution)
+		self._rows_per_strip = None
+		self._strip_offsets = [ ]
+		self._strip_byte_counts = [ ]
+		self._f.write(b"II*\x00\x00\x00\x00\x00")
+
+	def _write_band(self, band):
+		if self._rows_per_strip is None:
+			self._rows_per_strip = band.shape[0]
+		elif (len(self._strip_byte_counts) > 0) and (self._rows_written % self._rows_per_strip != 0):
+			raise ValueError("Only the last band may be shorter than %d rows." % (self._rows_per_strip))
+		elif band.shape[0] > self._rows_per_strip:
+			raise ValueError("Band of %d rows is higher than the first band of %d rows." % (band.shape[0], self._rows_per_strip))
+		data = zlib.compress(self._horizontal_difference(band).tobytes(), 6)
+		self._strip_offsets.append(self._f.tell())
+		self._strip_byte_counts.append(len(data))
+		self._f.write(data)
+		if len(data) % 2 == 1:
+			self._f.write(b"\x00")
+
+	def _write_values(self, value_type, values):
+		"""Writes values that do not fit into a directory entry and returns
+		their offset."""
+		offset = self._f.tell()
+		if value_type == self._TYPE_SHORT:
+			self._f.write(struct.pack("<%dH" % (len(values)), *values))
+		elif value_type == self._TYPE_LONG:
+			self._f.write(struct.pack("<%dL" % (len(values)), *values))
+		else:
+			self._f.write(struct.pack("<%dL" % (2 * len(values)), *[ part for value in values for part in value ]))
+		if self._f.tell() % 2 == 1:
+			self._f.write(b"\x00")
+		return offset
+
+	def _finish(self):
+		tags = [
+			(256, self._TYPE_LONG, [ self._width ]),
+			(257, self._TYPE_LONG, [ self._height ]),
+			(258, self._TYPE_SHORT, [ 8, 8, 8 ]),
+			(259, self._TYPE_SHORT, [ 8 ]),							# Adobe Deflate
+			(262, self._TYPE_SHORT, [ 2 ]),							# RGB
+			(273, self._TYPE_LONG, self._strip_offsets),
+			(277, self._TYPE_SHORT, [ 3 ]),
+			(278, self._TYPE_LONG, [ self._rows_per_strip ]),
+			(279, self._TYPE_LONG, self._strip_byte_counts),
+			(284, self._TYPE_SHORT, [ 1 ]),							# Chunky
+			(317, self._TYPE_SHORT, [ 2 ]),							# Horizontal differencing
+		]
+		if self._resolution is not None:
+			tags += [
+				(282, self._TYPE_RATIONAL, [ (self._resolution, 1) ]),
+				(283, self._TYPE_RATIONAL, [ (self._resolution, 1) ]),
+				(296, self._TYPE_SHORT, [ 2 ]),						# Inch
+			]
+		tags.sort()
+
+		entries = [ ]
+		for (tag, value_type, values) in tags:
+			if (value_type == self._TYPE_SHORT) and (len(values) <= 2):
+				inline = struct.pack("<%dH" % (len(values)), *values).ljust(4, b"\x00")
+			elif (value_type == self._TYPE_LONG) and (len(values) == 1):
+				inline = struct.pack("<L", values[0])
+			else:
+				inline = struct.pack("<L", self._write_values(value_type, values))
+			entries.append(struct.pack("<HHL", tag, value_type, len(values)) + inline)
+
+		directory_offset = self._f.tell()
+		self._f.write(struct.pack("<H", len(entries)))
+		for entry in entries:
+			self._f.write(entry)
+		self._f.write(struct.pack("<L", 0))
+		self._f.seek(4)
+		self._f.write(struct.pack("<L", directory_offset))
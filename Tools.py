@@ -19,13 +19,151 @@
 #
 #	Johannes Bauer <JohannesBauer@gmx.de>
 
+import os
 import geo
-import subprocess
+import glob
+import struct
 import json
+import collections
 
 class ImageTools():
+	ImageInfo = collections.namedtuple("ImageInfo", [ "format", "width", "height" ])
+
+	@classmethod
+	def _probe_jpeg(cls, f):
+		f.seek(2)
+		while True:
+			marker = f.read(2)
+			if (len(marker) < 2) or (marker[0] != 0xff):
+				return None
+			while marker[1] == 0xff:
+				# Fill bytes
+				marker = marker[1:] + f.read(1)
+			if (marker[1] == 0x01) or (0xd0 <= marker[1] <= 0xd7):
+				# Markers without payload
+				continue
+			(length, ) = struct.unpack(">H", f.read(2))
+			if (0xc0 <= marker[1] <= 0xcf) and (marker[1] not in (0xc4, 0xc8, 0xcc)):
+				(precision, height, width) = struct.unpack(">BHH", f.read(5))
+				return cls.ImageInfo(format = "JPEG", width = width, height = height)
+			elif marker[1] == 0xda:
+				# Start of scan without a preceding frame header
+				return None
+			else:
+				f.seek(length - 2, 1)
+
+	@classmethod
+	def _probe_png(cls, f):
+		header = f.read(24)
+		if header[12 : 16] != b"IHDR":
+			return None
+		(width, height) = struct.unpack(">LL", header[16 : 24])
+		return cls.ImageInfo(format = "PNG", width = width, height = height)
+
+	@classmethod
+	def _probe_webp(cls, f):
+		(width, height) = (None, None)
+		f.seek(12)
+		while True:
+			chunk_header = f.read(8)
+			if len(chunk_header) < 8:
+				break
+			(chunk_id, chunk_length) = struct.unpack("<4sL", chunk_header)
+			chunk = f.read(chunk_length + (chunk_length & 1))
+			if chunk_id == b"VP8X":
+				width = 1 + int.from_bytes(chunk[4 : 7], "little")
+				height = 1 + int.from_bytes(chunk[7 : 10], "little")
+			elif (chunk_id == b"VP8 ") and (width is None):
+				(width, height) = struct.unpack("<HH", chunk[6 : 10])
+				(width, height) = (width & 0x3fff, height & 0x3fff)
+				break
+			elif (chunk_id == b"VP8L") and (width is None):
+				bits = int.from_bytes(chunk[1 : 5], "little")
+				width = 1 + (bits & 0x3fff)
+				height = 1 + ((bits >> 14) & 0x3fff)
+				break
+		if width is None:
+			return None
+		return cls.ImageInfo(format = "WEBP", width = width, height = height)
+
+	@classmethod
+	def _probe_tiff(cls, f):
+		header = f.read(8)
+		endian = "<" if header[:2] == b"II" else ">"
+		(ifd_offset, ) = struct.unpack(endian + "L", header[4 : 8])
+		f.seek(ifd_offset)
+		(entry_count, ) = struct.unpack(endian + "H", f.read(2))
+		entries = f.read(12 * entry_count)
+		values = { }
+		for i in range(entry_count):
+			entry = entries[12 * i : 12 * (i + 1)]
+			(tag, field_type, _, value) = struct.unpack(endian + "HHL4s", entry)
+			if tag in (0x100, 0x101):
+				if field_type == 3:
+					values[tag] = struct.unpack(endian + "H", value[:2])[0]
+				else:
+					values[tag] = struct.unpack(endian + "L", value)[0]
+		if (0x100 not in values) or (0x101 not in values):
+			return None
+		return cls.ImageInfo(format = "TIFF", width = values[0x100], height = values[0x101])
+
+	@classmethod
+	def _probe_identify(cls, filename):
+		import subprocess
+		output = subprocess.check_output([ "identify", "-ping", "-format", "%m %w %h\n", filename ])
+		(image_format, width, height) = output.decode().split("\n")[0].split(" ")
+		return cls.ImageInfo(format = image_format, width = int(width), height = int(height))
+
+	@classmethod
+	def probe_image(cls, filename):
+		"""Determines format and geometry of an image by only looking at its
+		headers. Formats that are not understood and files whose headers are
+		truncated or corrupt are handed to ImageMagick's identify. The EXIF
+		orientation is deliberately not considered: POIs and all renderers
+		refer to the orientation the pixels are stored in."""
+		with open(filename, "rb") as f:
+			magic = f.read(12)
+			f.seek(0)
+			info = None
+			try:
+				if magic.startswith(b"\xff\xd8"):
+					info = cls._probe_jpeg(f)
+				elif magic.startswith(b"\x89PNG\r\n\x1a\n"):
+					info = cls._probe_png(f)
+				elif magic.startswith(b"RIFF") and (magic[8 : 12] == b"WEBP"):
+					info = cls._probe_webp(f)
+				elif magic[:4] in (b"II*\0", b"MM\0*"):
+					info = cls._probe_tiff(f)
+			except (struct.error, IndexError, ValueError, OSError):
+				info = None
+		if info is None:
+			info = cls._probe_identify(filename)
+		return info
+
+	@classmethod
+	def affine_coefficients(cls, affine):
+		"""Returns the 2x3 matrix (a, b, c, d, e, f) of a geo.TransformationMatrix
+		so that x' = a x + b y + c and y' = d x + e y + f."""
+		origin = affine.transform(geo.Vector2d(0, 0))
+		unit_x = affine.transform(geo.Vector2d(1, 0))
+		unit_y = affine.transform(geo.Vector2d(0, 1))
+		return (unit_x.x - origin.x, unit_y.x - origin.x, origin.x, unit_x.y - origin.y, unit_y.y - origin.y, origin.y)
+
+	@classmethod
+	def inverse_affine_coefficients(cls, coefficients):
+		(a, b, c, d, e, f) = coefficients
+		det = a * e - b * d
+		(ia, ib, id, ie) = (e / det, -b / det, -d / det, a / det)
+		return (ia, ib, -(ia * c + ib * f), id, ie, -(id * c + ie * f))
+
 	@classmethod
 	def get_image_geometry(cls, filename):
+		info = cls.probe_image(filename)
+		return (info.width, info.height)
+
+	@classmethod
+	def get_image_geometry_full_decode(cls, filename):
+		import subprocess
 		json_data = subprocess.check_output([ "convert", filename, "json:-" ])
 		data = json.loads(json_data)
 		image = data[0]["image"]
@@ -39,6 +177,10 @@ class ImageTools():
 	def imagemagick_draw_line(cls, p1, p2, stroke, stroke_width = 1):
 		return [ "-stroke", stroke, "-strokewidth", str(stroke_width), "-draw", "line %f,%f %f,%f" % (p1[0], p1[1], p2[0], p2[1]) ]
 
+	@classmethod
+	def imagemagick_draw_lines(cls, segments, stroke, stroke_width = 1):
+		return [ "-stroke", stroke, "-strokewidth", str(stroke_width), "-draw", " ".join("line %f,%f %f,%f" % segment for segment in segments) ]
+
 	@classmethod
 	def imagemagick_draw_relline(cls, p1, rel, stroke, stroke_width = 1):
 		p2 = p1 + rel
@@ -65,6 +207,62 @@ class ImageTools():
 		return [ "-stroke", "none", "-fill", color, "-font", font, "-pointsize", str(font_size), "-draw", "text %f,%f '%s'" % (pos.x, pos.y, text) ]
 
 	@classmethod
-	def imagemagick_blit(cls, infile, affine, cropbox, virtual = "Transparent"):
+	def imagemagick_overlay_mvg(cls, mvg_filename):
+		return [ "(", "-background", "none", "mvg:%s" % (mvg_filename), ")", "-geometry", "+0+0", "-composite" ]
+
+	@classmethod
+	def mvg_text(cls, text):
+		return "'%s'" % (text.replace("\\", "\\\\").replace("'", "\\'"))
+
+	@classmethod
+	def imagemagick_read_region(cls, infile, region = None):
+		if region is None:
+			return [ infile ]
+		(scaled_width, scaled_height) = region.scaled_size
+		(x, y, width, height) = region.crop
+		return [ "-define", "jpeg:size=%dx%d" % (scaled_width, scaled_height), infile, "-resize", "%dx%d!" % (scaled_width, scaled_height), "-crop", "%dx%d+%d+%d" % (width, height, x, y), "+repage" ]
+
+	@classmethod
+	def imagemagick_store_source(cls, name, infile, region = None):
+		return [ "(" ] + cls.imagemagick_read_region(infile, region) + [ "-write", "mpr:%s" % (name), "+delete", ")" ]
+
+	@classmethod
+	def imagemagick_blit(cls, infile, affine, cropbox, virtual = "Transparent", region = None, source = None):
+		"""Source can be given as the arguments that load an already decoded
+		source (e.g., an mpr: register), otherwise infile is read."""
 		matrix = ",".join("%f" % (value) for value in affine.aslist)
-		return [ "(", infile, "-virtual-pixel", virtual, "-affine", matrix, "-transform", "-crop", "%.0fx%.0f+%.0f+%.0f" % (cropbox.dimensions.x, cropbox.dimensions.y, cropbox.base.x, cropbox.base.y), ")", "-flatten" ]
+		if source is None:
+			source = cls.imagemagick_read_region(infile, region)
+		return [ "(" ] + source + [ "-virtual-pixel", virtual, "-affine", matrix, "-transform", "-crop", "%.0fx%.0f+%.0f+%.0f" % (cropbox.dimensions.x, cropbox.dimensions.y, cropbox.base.x, cropbox.base.y), ")", "-flatten" ]
+
+	@classmethod
+	def imagemagick_render_tile(cls, name, infile, affine, dimensions, virtual = "Transparent", region = None):
+		matrix = ",".join("%f" % (value) for value in affine.aslist)
+		return [ "(", "-size", "%.0fx%.0f" % (dimensions.x, dimensions.y), "xc:none", "(" ] + cls.imagemagick_read_region(infile, region) + [ "-virtual-pixel", virtual, "-affine", matrix, "-transform", ")", "-background", "none", "-flatten", "-write", "mpr:%s" % (name), "+delete", ")" ]
+
+	@classmethod
+	def imagemagick_place_tile(cls, name, pos):
+		return [ "mpr:%s" % (name), "-geometry", "+%.0f+%.0f" % (pos.x, pos.y), "-composite" ]
+
+class JobTools():
+	"""Helpers for the tools that process many input files at once."""
+	@classmethod
+	def expand_inputs(cls, patterns):
+		"""Expands directories (to the JSON files they contain) and glob
+		patterns; all other arguments are taken as filenames."""
+		filenames = [ ]
+		for pattern in patterns:
+			if os.path.isdir(pattern):
+				filenames += sorted(glob.glob(os.path.join(pattern, "*.json")))
+			elif glob.has_magic(pattern):
+				filenames += sorted(glob.glob(pattern))
+			else:
+				filenames.append(pattern)
+		return filenames
+
+	@classmethod
+	def output_filename(cls, output_template, input_filename):
+		"""Fills in an output filename template, in which {dir}, {name} and
+		{stem} refer to the input file."""
+		(stem, ext) = os.path.splitext(os.path.basename(input_filename))
+		return output_template.format(dir = os.path.dirname(input_filename) or ".", name = os.path.basename(input_filename), stem = stem)
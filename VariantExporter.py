@@ -0,0 +1,189 @@
+#	gbpig - German Biometric Passport Image Generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of gbpig.
+#
+#	gbpig is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	gbpig is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with gbpig; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+import io
+import os
+import time
+import collections
+import concurrent.futures
+from PassportGenerator import PassportGenerator
+from PillowRenderer import PillowRenderer, SourceCache
+from Renderer import SourceRegion
+from FriendlyArgumentParser import baseint_unit
+import geo
+
+Variant = collections.namedtuple("Variant", [ "kind", "filename", "resolution", "canvas", "max_bytes", "quality" ])
+
+class VariantGenerator(PassportGenerator):
+	"""Renders a single variant, decoding from a source region that is shared
+	by all variants instead of one that is tailored to this variant."""
+	def __init__(self, args, job_data, source_cache, source_region = None):
+		super().__init__(args, source_cache = source_cache, job_data = job_data)
+		self._definitions = self._DEFINITIONS[args.picture_type]
+		self._shared_source_region = source_region
+		self._renderer = PillowRenderer(verbose = args.verbose, source_cache = source_cache)
+
+	def _compute_source_region(self, image_geometry):
+		if self._shared_source_region is not None:
+			return self._shared_source_region
+		region = super()._compute_source_region(image_geometry)
+		if region is None:
+			# Make the whole image an explicit region, so that it can be
+			# shared as well
+			region = SourceRegion(image_geometry, 1, (0, 0, image_geometry[0], image_geometry[1]))
+		return region
+
+	def render_sheet(self):
+		self._compute_geometry()
+		self._create_image()
+		return self._renderer.finish()
+
+	def render_single(self):
+		"""Renders only the inner image without border and cut marks, e.g.,
+		for online applications."""
+		self._compute_geometry()
+		image_dimension_px = self._to_px(self._image_dimension_mm)
+		self._renderer.new_canvas(image_dimension_px, "white")
+		affine = self._tile_affine * geo.TransformationMatrix.translate(geo.Vector2d(-self._image_border_px, -self._image_border_px))
+		self._renderer.blit(self._in["image"]["filename"], affine, geo.Box2d(base = geo.Vector2d(0, 0), dimensions = image_dimension_px), region = self._source_region)
+		return self._renderer.finish()
+
+class VariantExporter():
+	"""Renders several variants of one classified image (printable sheets and
+	single digital images at different resolutions and formats) in parallel.
+	The geometry is computed once for the highest resolution and the source
+	is decoded once; variants at lower resolutions reduce the shared decode."""
+	_KINDS = [ "sheet", "single" ]
+
+	def __init__(self, args, job_data, jobs = None):
+		self._args = args
+		self._job_data = job_data
+		self._jobs = jobs
+		self._variants = [ ]
+
+	@classmethod
+	def parse_variant(cls, text, default_resolution = 300):
+		"""Parses a variant given as kind:filename[:key=value,...], where
+		the keys can be dpi, canvas (WxH in mm), max-size (in bytes, e.g.,
+		500k) and quality."""
+		parts = text.split(":", 2)
+		if len(parts) < 2:
+			raise ValueError("Variant '%s' needs to be given as kind:filename[:options]." % (text))
+		(kind, filename) = (parts[0], parts[1])
+		if kind not in cls._KINDS:
+			raise ValueError("Variant kind '%s' is unknown, must be one of %s." % (kind, ", ".join(cls._KINDS)))
+		options = { }
+		if (len(parts) == 3) and (parts[2] != ""):
+			for option in parts[2].split(","):
+				(key, _, value) = option.partition("=")
+				options[key.strip()] = value.strip()
+		unknown = set(options) - set([ "dpi", "canvas", "max-size", "quality" ])
+		if len(unknown) > 0:
+			raise ValueError("Variant '%s' has unknown option(s): %s" % (text, ", ".join(sorted(unknown))))
+
+		canvas = None
+		if "canvas" in options:
+			(width, height) = options["canvas"].lower().split("x")
+			canvas = (float(width), float(height))
+		return Variant(kind = kind, filename = filename, resolution = int(options.get("dpi", default_resolution)), canvas = canvas, max_bytes = baseint_unit(options["max-size"]) if ("max-size" in options) else None, quality = int(options.get("quality", 92)))
+
+	def add_variant(self, variant):
+		self._variants.append(variant)
+
+	def _variant_args(self, variant):
+		(canvas_width, canvas_height) = variant.canvas if (variant.canvas is not None) else (self._args.canvas_width, self._args.canvas_height)
+		return PassportGenerator.create_args(resolution = variant.resolution, picture_type = self._args.picture_type, border_size = self._args.border_size, line_size = self._args.line_size, canvas_width = canvas_width, canvas_height = canvas_height, check = self._args.check, render_mode = "tile", backend = "pillow", no_cache = True, verbose = self._args.verbose)
+
+	@staticmethod
+	def _encode_jpeg(image, quality, resolution):
+		buffer = io.BytesIO()
+		image.save(buffer, format = "JPEG", quality = quality, optimize = True, dpi = (resolution, resolution))
+		return buffer.getvalue()
+
+	@classmethod
+	def _encode_jpeg_budget(cls, image, max_bytes, max_quality, resolution):
+		"""Binary search for the highest quality whose encoding fits the byte
+		budget. Returns the lowest quality's encoding if nothing fits."""
+		(low, high) = (1, max_quality)
+		best = None
+		while low <= high:
+			quality = (low + high) // 2
+			data = cls._encode_jpeg(image, quality, resolution)
+			if len(data) <= max_bytes:
+				best = (quality, data)
+				low = quality + 1
+			else:
+				high = quality - 1
+		if best is None:
+			best = (1, cls._encode_jpeg(image, 1, resolution))
+		return best
+
+	def _save(self, image, variant):
+		ext = os.path.splitext(variant.filename)[1].lower()
+		quality = None
+		if ext in [ ".jpg", ".jpeg" ]:
+			if variant.max_bytes is not None:
+				(quality, data) = self._encode_jpeg_budget(image, variant.max_bytes, variant.quality, variant.resolution)
+			else:
+				(quality, data) = (variant.quality, self._encode_jpeg(image, variant.quality, variant.resolution))
+			with open(variant.filename, "wb") as f:
+				f.write(data)
+		else:
+			# PDF takes "resolution", all other formats take "dpi"
+			image.save(variant.filename, resolution = variant.resolution, dpi = (variant.resolution, variant.resolution))
+		return quality
+
+	def _render_variant(self, variant, source_cache, source_region):
+		t0 = time.perf_counter()
+		generator = VariantGenerator(self._variant_args(variant), self._job_data, source_cache, source_region)
+		if variant.kind == "sheet":
+			image = generator.render_sheet()
+		else:
+			image = generator.render_single()
+		t_rendered = time.perf_counter()
+		quality = self._save(image, variant)
+		t_saved = time.perf_counter()
+		return {
+			"filename":			variant.filename,
+			"kind":				variant.kind,
+			"resolution":		variant.resolution,
+			"size":				os.path.getsize(variant.filename),
+			"quality":			quality,
+			"within_budget":	(variant.max_bytes is None) or (os.path.getsize(variant.filename) <= variant.max_bytes),
+			"render_time":		t_rendered - t0,
+			"encode_time":		t_saved - t_rendered,
+		}
+
+	def _shared_source_region(self, source_cache):
+		# The region that the highest resolution needs also serves all lower
+		# resolutions, which only reduce it further
+		highest = max(self._variants, key = lambda variant: variant.resolution)
+		return VariantGenerator(self._variant_args(highest), self._job_data, source_cache).compute_source_region()
+
+	def run(self):
+		if len(self._variants) == 0:
+			raise ValueError("No variants to export.")
+		source_cache = SourceCache(capacity = 8)
+		source_region = self._shared_source_region(source_cache)
+		with concurrent.futures.ThreadPoolExecutor(max_workers = self._jobs) as executor:
+			futures = [ executor.submit(self._render_variant, variant, source_cache, source_region) for variant in self._variants ]
+			return [ future.result() for future in futures ]
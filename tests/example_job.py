@@ -0,0 +1,47 @@
+#	gbpig - German Biometric Passport Image Generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of gbpig.
+#
+#	gbpig is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	gbpig is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with gbpig; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+import os
+import json
+import numpy
+import PIL.Image
+from PassportGenerator import PassportGenerator
+
+BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+def example_job_data():
+	with open(os.path.join(BASE_DIR, "example.json")) as f:
+		job_data = json.load(f)
+	job_data["image"]["filename"] = os.path.join(BASE_DIR, job_data["image"]["filename"])
+	return job_data
+
+def render_example(output_filename, source_cache = None, **kwargs):
+	"""Renders example.json with the given options and returns the output as
+	an RGB NumPy array."""
+	args = PassportGenerator.create_args(no_cache = True, **kwargs)
+	args.image_output_filename = output_filename
+	PassportGenerator(args, source_cache = source_cache, job_data = example_job_data()).run()
+	return load_rgb(output_filename)
+
+def load_rgb(filename):
+	with PIL.Image.open(filename) as image:
+		return numpy.asarray(image.convert("RGB"))
@@ -0,0 +1,79 @@
+#	gbpig - German Biometric Passport Image Generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of gbpig.
+#
+#	gbpig is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	gbpig is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with gbpig; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+import os
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+
+try:
+	from example_job import BASE_DIR, render_example, load_rgb, example_job_data
+	from PassportGenerator import PassportGenerator
+except ImportError:
+	render_example = None
+
+@unittest.skipIf(render_example is None, "Pillow and NumPy are required")
+class BackendTests(unittest.TestCase):
+	# Mean absolute difference per channel (0 - 255) that is accepted between
+	# the backends. They differ in resampling, antialiasing and fonts; measured
+	# are about 2.4 for print and 3.2 for check sheets.
+	_TOLERANCE = 3
+	_CHECK_TOLERANCE = 4
+
+	def _assert_similar(self, image, reference, tolerance):
+		self.assertEqual(image.shape, reference.shape)
+		difference = abs(image.astype(float) - reference.astype(float)).mean()
+		self.assertLessEqual(difference, tolerance)
+
+	def test_pillow_matches_reference(self):
+		# The reference images were rendered by ImageMagick
+		with tempfile.TemporaryDirectory() as tmp_dir:
+			for (check, reference_filename, tolerance) in [ (False, "example_print_me.jpg", self._TOLERANCE), (True, "example_check_me.jpg", self._CHECK_TOLERANCE) ]:
+				for render_mode in [ "tile", "slot" ]:
+					with self.subTest(check = check, render_mode = render_mode):
+						image = render_example(os.path.join(tmp_dir, "output.png"), backend = "pillow", render_mode = render_mode, check = check)
+						self._assert_similar(image, load_rgb(os.path.join(BASE_DIR, reference_filename)), tolerance)
+
+	@unittest.skipIf(shutil.which("convert") is None, "ImageMagick is required")
+	def test_pillow_matches_imagemagick(self):
+		with tempfile.TemporaryDirectory() as tmp_dir:
+			for check in [ False, True ]:
+				with self.subTest(check = check):
+					reference = render_example(os.path.join(tmp_dir, "imagemagick.png"), backend = "imagemagick", check = check)
+					image = render_example(os.path.join(tmp_dir, "pillow.png"), backend = "pillow", check = check)
+					self._assert_similar(image, reference, self._CHECK_TOLERANCE if check else self._TOLERANCE)
+
+	def test_imagemagick_single_draw_pass(self):
+		# Only the command line is checked, ImageMagick is not run
+		with tempfile.TemporaryDirectory() as tmp_dir, unittest.mock.patch("subprocess.check_call") as check_call:
+			for check in [ False, True ]:
+				for render_mode in [ "tile", "slot" ]:
+					with self.subTest(check = check, render_mode = render_mode):
+						args = PassportGenerator.create_args(no_cache = True, backend = "imagemagick", render_mode = render_mode, check = check)
+						args.image_output_filename = os.path.join(tmp_dir, "output.png")
+						PassportGenerator(args, job_data = example_job_data()).run()
+						cmdline = check_call.call_args[0][0]
+						self.assertEqual(len([ arg for arg in cmdline if arg.startswith("mvg:") ]), 1)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,56 @@
+#	gbpig - German Biometric Passport Image Generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of gbpig.
+#
+#	gbpig is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	gbpig is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with gbpig; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+import os
+import tempfile
+import unittest
+
+try:
+	from example_job import render_example
+	from PassportGenerator import PassportGeneratorException
+except ImportError:
+	render_example = None
+
+@unittest.skipIf(render_example is None, "Pillow and NumPy are required")
+class BandedRendererTests(unittest.TestCase):
+	def _render(self, output_filename, **kwargs):
+		return render_example(output_filename, backend = "pillow", **kwargs)
+
+	def test_banded_identical(self):
+		# 100 does not divide the 1772 rows of the default sheet, so one band is
+		# shorter and cut lines end up right next to band boundaries
+		with tempfile.TemporaryDirectory() as tmp_dir:
+			for (render_mode, check) in [ ("tile", False), ("slot", False), ("tile", True) ]:
+				reference = self._render(os.path.join(tmp_dir, "reference.png"), render_mode = render_mode, check = check)
+				banded = self._render(os.path.join(tmp_dir, "banded.png"), render_mode = render_mode, check = check, band_height = 100)
+				self.assertEqual(reference.shape, banded.shape)
+				self.assertTrue((reference == banded).all(), "%s mode%s: %d pixels differ" % (render_mode, ", check" if check else "", (reference != banded).any(axis = 2).sum()))
+
+	def test_unsupported_output(self):
+		with tempfile.TemporaryDirectory() as tmp_dir:
+			output_filename = os.path.join(tmp_dir, "banded.jpg")
+			with self.assertRaises(PassportGeneratorException):
+				self._render(output_filename, band_height = 100)
+			self.assertFalse(os.path.exists(output_filename))
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,47 @@
+#	gbpig - German Biometric Passport Image Generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of gbpig.
+#
+#	gbpig is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	gbpig is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with gbpig; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+import unittest
+
+try:
+	import cv2
+	import numpy
+except ImportError:
+	cv2 = None
+
+from Classification import AutoClassifier
+
+@unittest.skipIf(cv2 is None, "OpenCV and NumPy are required")
+class AutoClassifierTests(unittest.TestCase):
+	def test_rotation_roundtrip(self):
+		classifier = AutoClassifier()
+		for angle_deg in [ -30, -15, 15, 30 ]:
+			image = numpy.zeros((120, 200), dtype = numpy.uint8)
+			image[49 : 52, 79 : 82] = 255
+			(rotated, back_angle) = classifier._rotate_image(image, angle_deg)
+			(y, x) = numpy.unravel_index(rotated.argmax(), rotated.shape)
+			(x, y) = AutoClassifier._rotate_point((x, y), (image.shape[1] / 2, image.shape[0] / 2), back_angle)
+			self.assertAlmostEqual(x, 80, delta = 1.5, msg = "%d°" % (angle_deg))
+			self.assertAlmostEqual(y, 50, delta = 1.5, msg = "%d°" % (angle_deg))
+
+if __name__ == "__main__":
+	unittest.main()
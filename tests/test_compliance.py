@@ -0,0 +1,78 @@
+#	gbpig - German Biometric Passport Image Generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of gbpig.
+#
+#	gbpig is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	gbpig is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with gbpig; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+
+import copy
+import unittest
+
+try:
+	from example_job import example_job_data
+	from ComplianceChecker import ComplianceChecker
+	from PassportGenerator import PassportGenerator
+	from Tools import ImageTools
+except ImportError:
+	example_job_data = None
+
+@unittest.skipIf(example_job_data is None, "Pillow and NumPy are required")
+class ComplianceCheckerTests(unittest.TestCase):
+	def test_matches_generator(self):
+		job_data = example_job_data()
+		for picture_type in [ "adult", "child" ]:
+			for resolution in [ 300, 600 ]:
+				with self.subTest(picture_type = picture_type, resolution = resolution):
+					result = ComplianceChecker(picture_type = picture_type, resolution = resolution).check([ job_data ])
+					ppgen = PassportGenerator(PassportGenerator.create_args(picture_type = picture_type, resolution = resolution), job_data = job_data)
+					ppgen.compute_source_region()
+					px_per_mm = resolution / 25.4
+					self.assertAlmostEqual(result["scale"][0], ppgen._image_scale, places = 9)
+					self.assertAlmostEqual(result["head_to_chin_mm"][0], (ppgen._tile_chin_px.y - ppgen._tile_top_px.y) / px_per_mm, places = 6)
+					self.assertAlmostEqual(result["top_margin_mm"][0], (ppgen._tile_top_px.y - ppgen._image_border_px) / px_per_mm, places = 6)
+
+					# The inner image corners, mapped back into the source
+					(ia, ib, ic, id, ie, if_) = ImageTools.inverse_affine_coefficients(ImageTools.affine_coefficients(ppgen._tile_affine))
+					(border, dimension) = (ppgen._image_border_px, ppgen._bordered_image_dimension_px)
+					corners = [ (x, y) for x in (border, dimension.x - border) for y in (border, dimension.y - border) ]
+					(width, height) = job_data["image"]["geometry"]
+					covered = all((0 <= (ia * x) + (ib * y) + ic <= width) and (0 <= (id * x) + (ie * y) + if_ <= height) for (x, y) in corners)
+					self.assertEqual(bool(result["covered"][0]), covered)
+
+	def test_invalid_pois(self):
+		job_data = example_job_data()
+		collapsed = copy.deepcopy(job_data)
+		collapsed["pois"]["right_eye"] = collapsed["pois"]["left_eye"]
+		result = ComplianceChecker().check([ job_data, collapsed ])
+		self.assertEqual(list(result["valid"]), [ True, False ])
+		self.assertEqual(result["status"][1], "illegal")
+		self.assertEqual(ComplianceChecker.reasons(result, 1), [ "invalid POIs" ])
+
+	def test_extract_errors(self):
+		missing = example_job_data()
+		del missing["pois"]["nose"]
+		with self.assertRaisesRegex(ValueError, "missing 'nose'"):
+			ComplianceChecker.extract(missing)
+		malformed = example_job_data()
+		malformed["pois"]["left_eye"] = [ 1 ]
+		with self.assertRaisesRegex(ValueError, "malformed"):
+			ComplianceChecker.extract(malformed)
+
+if __name__ == "__main__":
+	unittest.main()
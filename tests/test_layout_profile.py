@@ -0,0 +1,60 @@
+#	gbpig - German Biometric Passport Image Generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of gbpig.
+#
+#	gbpig is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	gbpig is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with gbpig; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+
+import tempfile
+import unittest
+from LayoutProfile import LayoutProfile, LayoutProfileException
+from PassportGenerator import PassportGenerator
+
+class LayoutProfileTests(unittest.TestCase):
+	def _save_profile(self, directory, **kwargs):
+		args = PassportGenerator.create_args(**kwargs)
+		LayoutProfile.from_args("p1", args, layout = { }).save(directory)
+
+	def test_unknown_profile(self):
+		with tempfile.TemporaryDirectory() as profile_dir:
+			with self.assertRaisesRegex(LayoutProfileException, "no profiles have been saved"):
+				LayoutProfile.load(profile_dir, "p1")
+			self._save_profile(profile_dir)
+			with self.assertRaisesRegex(LayoutProfileException, "available profiles: p1"):
+				LayoutProfile.load(profile_dir, "p2")
+
+	def test_apply(self):
+		with tempfile.TemporaryDirectory() as profile_dir:
+			self._save_profile(profile_dir, resolution = 600)
+			profile = LayoutProfile.load(profile_dir, "p1")
+			defaults = PassportGenerator.create_args()
+
+			# Default and matching values are replaced
+			for resolution in [ 300, 600 ]:
+				args = PassportGenerator.create_args(resolution = resolution)
+				profile.apply(args, defaults = defaults)
+				self.assertEqual(args.resolution, 600)
+
+			# Conflicting values are rejected
+			args = PassportGenerator.create_args(resolution = 1200, picture_type = "child")
+			with self.assertRaisesRegex(LayoutProfileException, "resolution 1200.*picture_type child"):
+				profile.apply(args, defaults = defaults)
+
+if __name__ == "__main__":
+	unittest.main()
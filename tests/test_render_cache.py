@@ -0,0 +1,115 @@
+#	gbpig - German Biometric Passport Image Generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of gbpig.
+#
+#	gbpig is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	gbpig is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with gbpig; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+
+import os
+import time
+import tempfile
+import unittest
+import unittest.mock
+from RenderCache import RenderCache
+from example_job import BASE_DIR, example_job_data
+from PassportGenerator import PassportGenerator
+
+class RenderCacheTests(unittest.TestCase):
+	def setUp(self):
+		self._tmp_dir = tempfile.TemporaryDirectory()
+		self._cache_dir = os.path.join(self._tmp_dir.name, "cache")
+
+	def tearDown(self):
+		self._tmp_dir.cleanup()
+
+	def _write(self, filename, data):
+		filename = os.path.join(self._tmp_dir.name, filename)
+		with open(filename, "wb") as f:
+			f.write(data)
+		return filename
+
+	def _read(self, filename):
+		with open(filename, "rb") as f:
+			return f.read()
+
+	def _key(self, source_filename = None, pois = None, definitions = None, layout = None):
+		job_data = example_job_data()
+		return RenderCache.compute_key(source_filename or job_data["image"]["filename"], pois or job_data["pois"], definitions or { "top-to-eyes": [ 13, 23 ] }, layout or { "resolution": 300 })
+
+	def test_hit_and_miss(self):
+		cache = RenderCache(self._cache_dir, 1024 * 1024)
+		output_filename = os.path.join(self._tmp_dir.name, "output.jpg")
+		self.assertFalse(cache.fetch("a" * 64, output_filename))
+		self.assertFalse(os.path.exists(output_filename))
+
+		cache.store("a" * 64, self._write("rendered.jpg", b"rendered"))
+		self.assertTrue(cache.fetch("a" * 64, output_filename))
+		self.assertEqual(self._read(output_filename), b"rendered")
+
+		# Entries are stored per output format
+		self.assertFalse(cache.fetch("a" * 64, os.path.join(self._tmp_dir.name, "output.png")))
+		self.assertFalse(cache.fetch("b" * 64, output_filename))
+
+	def test_key_sensitivity(self):
+		key = self._key()
+		self.assertEqual(key, self._key())
+		pois = example_job_data()["pois"]
+		pois["chin_y"] += 1
+		self.assertNotEqual(key, self._key(pois = pois))
+		self.assertNotEqual(key, self._key(definitions = { "top-to-eyes": [ 13, 27 ] }))
+		self.assertNotEqual(key, self._key(layout = { "resolution": 600 }))
+		self.assertNotEqual(key, self._key(source_filename = os.path.join(BASE_DIR, "example_print_me.jpg")))
+		with unittest.mock.patch.object(RenderCache, "_code_version", "0" * 64):
+			self.assertNotEqual(key, self._key())
+
+	def test_code_version(self):
+		code_version = RenderCache.code_version()
+		self.assertEqual(len(code_version), 64)
+		with unittest.mock.patch.object(RenderCache, "_code_version", None), unittest.mock.patch.object(RenderCache, "_CODE_FILES", [ "PassportGenerator.py" ]):
+			self.assertNotEqual(RenderCache.code_version(), code_version)
+
+	def test_lru_eviction(self):
+		cache = RenderCache(self._cache_dir, 250)
+		output_filename = os.path.join(self._tmp_dir.name, "output.jpg")
+		for key in [ "a", "b" ]:
+			cache.store(key * 64, self._write("%s.jpg" % (key), key.encode() * 100))
+			time.sleep(0.05)
+
+		# Using "a" makes "b" the least recently used entry
+		self.assertTrue(cache.fetch("a" * 64, output_filename))
+		time.sleep(0.05)
+		cache.store("c" * 64, self._write("c.jpg", b"c" * 100))
+		self.assertTrue(cache.fetch("a" * 64, output_filename))
+		self.assertFalse(cache.fetch("b" * 64, output_filename))
+		self.assertTrue(cache.fetch("c" * 64, output_filename))
+
+	def test_generator(self):
+		def run(**kwargs):
+			args = PassportGenerator.create_args(backend = "pillow", cache_dir = self._cache_dir, **kwargs)
+			args.image_output_filename = os.path.join(self._tmp_dir.name, "print_me.jpg")
+			ppgen = PassportGenerator(args, job_data = example_job_data())
+			ppgen.run()
+			return [ stage.name for stage in ppgen.timer.stages ]
+
+		self.assertIn("render", run())
+		self.assertEqual(run(), [ "cache lookup" ])
+		self.assertIn("render", run(picture_type = "child"))
+
+if __name__ == "__main__":
+	unittest.main()
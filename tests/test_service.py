@@ -0,0 +1,111 @@
+#	gbpig - German Biometric Passport Image Generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of gbpig.
+#
+#	gbpig is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	gbpig is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with gbpig; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+
+import os
+import tempfile
+import threading
+import unittest
+import unittest.mock
+
+try:
+	from example_job import example_job_data
+	from PassportGenerator import PassportGenerator
+	from RenderService import RenderService, RenderHTTPServer, RenderUnixServer, RenderClient, RenderServiceException
+except ImportError:
+	example_job_data = None
+
+@unittest.skipIf(example_job_data is None, "Pillow and NumPy are required")
+class RenderServiceTests(unittest.TestCase):
+	def setUp(self):
+		self._tmp_dir = tempfile.TemporaryDirectory()
+		self._output_dir = os.path.join(self._tmp_dir.name, "output")
+		default_args = PassportGenerator.create_args(backend = "pillow", no_cache = True)
+		self._service = RenderService(default_args, concurrency = 1, queue_size = 0, output_dir = self._output_dir)
+
+	def tearDown(self):
+		self._tmp_dir.cleanup()
+
+	def _serve(self, server):
+		thread = threading.Thread(target = server.serve_forever)
+		thread.start()
+		def stop():
+			server.shutdown()
+			server.server_close()
+			thread.join()
+		self.addCleanup(stop)
+
+	def _http_client(self):
+		server = RenderHTTPServer(("127.0.0.1", 0), self._service)
+		self._serve(server)
+		return RenderClient(host = "127.0.0.1", port = server.server_address[1])
+
+	def test_render_bytes(self):
+		(result, timing) = self._http_client().render(example_job_data())
+		self.assertTrue(result.startswith(b"\xff\xd8"))
+		self.assertEqual(set(timing), set([ "queue", "render", "total" ]))
+
+	def test_render_unix_socket(self):
+		socket_filename = os.path.join(self._tmp_dir.name, "service.sock")
+		self._serve(RenderUnixServer(socket_filename, self._service))
+		(result, timing) = RenderClient(socket_filename = socket_filename).render(example_job_data(), output_format = "png")
+		self.assertTrue(result.startswith(b"\x89PNG"))
+
+	def test_render_output_filename(self):
+		(result, timing) = self._http_client().render(example_job_data(), output_filename = "sub/print_me.jpg")
+		self.assertEqual(result, os.path.join(os.path.realpath(self._output_dir), "sub", "print_me.jpg"))
+		self.assertTrue(os.path.isfile(result))
+
+	def test_invalid_requests(self):
+		client = self._http_client()
+		for (options, output_filename) in [ ({ "picture_type": "kid" }, None), ({ "resolution": "many" }, None), ({ "cache_dir": "/tmp" }, None), ({ }, "../escaped.jpg") ]:
+			with self.subTest(options = options, output_filename = output_filename):
+				with self.assertRaises(RenderServiceException) as context:
+					client.render(example_job_data(), options = options, output_filename = output_filename)
+				self.assertEqual(context.exception.status, 400)
+		self.assertEqual(client.status()["failed"], 0)
+
+	def test_queue_full(self):
+		client = self._http_client()
+		(rendering, release) = (threading.Event(), threading.Event())
+		run = PassportGenerator.run
+		def blocking_run(ppgen):
+			rendering.set()
+			release.wait(10)
+			run(ppgen)
+
+		with unittest.mock.patch.object(PassportGenerator, "run", blocking_run):
+			first = threading.Thread(target = client.render, args = (example_job_data(), ))
+			first.start()
+			try:
+				self.assertTrue(rendering.wait(10))
+				with self.assertRaises(RenderServiceException) as context:
+					client.render(example_job_data())
+				self.assertEqual(context.exception.status, 503)
+			finally:
+				release.set()
+				first.join()
+		stats = client.status()
+		self.assertEqual((stats["rejected"], stats["completed"], stats["failed"]), (1, 1, 0))
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,78 @@
+#	gbpig - German Biometric Passport Image Generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of gbpig.
+#
+#	gbpig is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	gbpig is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with gbpig; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+
+import os
+import tempfile
+import unittest
+import unittest.mock
+
+try:
+	from example_job import render_example, example_job_data
+	from PillowRenderer import SourceCache
+	from PassportGenerator import PassportGenerator
+except ImportError:
+	render_example = None
+
+@unittest.skipIf(render_example is None, "Pillow and NumPy are required")
+class SourceCacheTests(unittest.TestCase):
+	def _render_all(self, source_cache, picture_types):
+		with tempfile.TemporaryDirectory() as tmp_dir, unittest.mock.patch.object(SourceCache, "decode", wraps = SourceCache.decode) as decode:
+			for (job_no, picture_type) in enumerate(picture_types):
+				render_example(os.path.join(tmp_dir, "out_%d.png" % (job_no)), source_cache = source_cache, backend = "pillow", picture_type = picture_type)
+			return decode.call_count
+
+	def _source_region(self, picture_type):
+		args = PassportGenerator.create_args(backend = "pillow", picture_type = picture_type)
+		return PassportGenerator(args, job_data = example_job_data()).compute_source_region()
+
+	def test_regions_differ(self):
+		# Otherwise the other tests would not show anything
+		(adult, child) = (self._source_region("adult"), self._source_region("child"))
+		self.assertNotEqual(adult, child)
+		self.assertFalse(child.covers(adult))
+		self.assertTrue(adult.union(child).covers(adult))
+		self.assertTrue(adult.union(child).covers(child))
+
+	def test_reserved_single_decode(self):
+		source_cache = SourceCache()
+		filename = example_job_data()["image"]["filename"]
+		for picture_type in [ "child", "adult" ]:
+			source_cache.reserve(filename, self._source_region(picture_type))
+		self.assertEqual(self._render_all(source_cache, [ "child", "adult", "child" ]), 1)
+
+	def test_covered_single_decode(self):
+		# The adult decode has the higher scale and covers the child region
+		self.assertEqual(self._render_all(SourceCache(), [ "adult", "child", "adult" ]), 1)
+
+	def test_decode_grows(self):
+		# Without reservations, the adult job enlarges the decode, which then
+		# also serves the second child job
+		self.assertEqual(self._render_all(SourceCache(), [ "child", "adult", "child" ]), 2)
+
+	def test_full_decode_shared(self):
+		source_cache = SourceCache()
+		source_cache.reserve(example_job_data()["image"]["filename"], None)
+		self.assertEqual(self._render_all(source_cache, [ "child", "adult", "child" ]), 1)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,56 @@
+#	gbpig - German Biometric Passport Image Generator
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of gbpig.
+#
+#	gbpig is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	gbpig is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with gbpig; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+
+import os
+import struct
+import tempfile
+import unittest
+import unittest.mock
+from Tools import ImageTools
+
+class ProbeImageTests(unittest.TestCase):
+	_EXAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "example.jpg")
+
+	def _probe_data(self, data):
+		fallback = ImageTools.ImageInfo(format = "identify", width = 1, height = 1)
+		with tempfile.NamedTemporaryFile() as f:
+			f.write(data)
+			f.flush()
+			with unittest.mock.patch.object(ImageTools, "_probe_identify", return_value = fallback):
+				return ImageTools.probe_image(f.name)
+
+	def test_jpeg(self):
+		with open(self._EXAMPLE, "rb") as f:
+			data = f.read()
+		info = self._probe_data(data)
+		self.assertEqual((info.format, info.width, info.height), ("JPEG", 1226, 1226))
+
+	def test_truncated_falls_back(self):
+		with open(self._EXAMPLE, "rb") as f:
+			jpeg_data = f.read(64)
+		tiff_data = b"II*\0" + struct.pack("<L", 1000)
+		for data in [ jpeg_data, jpeg_data[:5], tiff_data, b"MM\0*" ]:
+			with self.subTest(data = data[:8]):
+				self.assertEqual(self._probe_data(data).format, "identify")
+
+if __name__ == "__main__":
+	unittest.main()